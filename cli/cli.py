@@ -315,3 +315,63 @@ def coordinate(ctx, coordinate, space, parcellation, labelled, sigma_mm):
             click.echo(f"{region.name:40.40} {values}")
         else:
             click.echo(region.name)
+
+
+# ---- Manage the cache
+
+
+@siibra.group()
+@click.pass_context
+def cache(ctx):
+    """Inspect and prepare the local siibra cache"""
+    pass
+
+
+@cache.command()
+@click.argument("manifestfile", type=click.STRING)
+@click.pass_context
+def manifest(ctx, manifestfile):
+    """Write the list of URLs needed by the current configuration to a file"""
+    from siibra.retrieval.manifest import build_config_manifest
+    result = build_config_manifest()
+    result.save(manifestfile)
+    click.echo(f"Manifest of {len(result)} URLs for '{result.tag}' written to {manifestfile}.")
+
+
+@cache.command()
+@click.argument("manifestfile", type=click.STRING)
+@click.pass_context
+def check(ctx, manifestfile):
+    """Check that all URLs of a manifest are available in the cache"""
+    from siibra.retrieval.manifest import Manifest
+    from siibra.retrieval.cache import CACHE
+    missing = Manifest.load(manifestfile).missing()
+    for url in missing:
+        click.echo(f"Missing: {url}")
+    if len(missing) > 0:
+        click.echo(f"{len(missing)} entries of {manifestfile} are missing in {CACHE.folder}.")
+        exit(1)
+    click.echo(f"Cache at {CACHE.folder} is complete.")
+
+
+@cache.command()
+@click.argument("manifestfile", type=click.STRING)
+@click.option(
+    "-w",
+    "--workers",
+    type=click.INT,
+    default=None,
+    help="Maximum number of concurrent downloads (default: SIIBRA_PREFETCH_WORKERS)",
+)
+@click.pass_context
+def replay(ctx, manifestfile, workers):
+    """Retrieve the entries of a (recorded) manifest into the cache"""
+    from siibra.retrieval.manifest import Manifest
+    from siibra.retrieval.cache import CACHE
+    manifest = Manifest.load(manifestfile)
+    count, failed = manifest.replay(max_workers=workers)
+    for url in failed:
+        click.echo(f"Failed: {url}")
+    click.echo(f"{count} of {len(manifest)} entries retrieved into {CACHE.folder}.")
+    if len(failed) > 0:
+        exit(1)
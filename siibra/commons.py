@@ -17,6 +17,7 @@ import os
 from enum import Enum
 from nibabel import Nifti1Image
 import logging
+import threading
 import numpy as np
 
 logger = logging.getLogger(__name__.split(os.path.extsep)[0])
@@ -47,10 +48,46 @@ QUIET = LoggingContext("ERROR")
 VERBOSE = LoggingContext("DEBUG")
 
 
+# guards the construction of lazy registry elements across threads
+_LAZY_LOCK = threading.RLock()
+
+
+class LazyElement:
+    """
+    Placeholder for an element of a Registry, which constructs
+    the actual object only when it is accessed for the first time.
+    Derived classes implement build(), and possibly matches()
+    to allow matching a specification without building the object.
+    """
+
+    _built = None
+
+    def build(self):
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not implement build()."
+        )
+
+    def matches(self, spec):
+        return False
+
+    def get(self):
+        """ Return the element, constructing it if needed. """
+        with _LAZY_LOCK:
+            if self._built is None:
+                self._built = self.build()
+        return self._built
+
+    def peek(self):
+        """ Return the element if it was already constructed, otherwise this placeholder. """
+        return self if self._built is None else self._built
+
+
 class Registry:
     """
     Provide attribute-access and iteration to a set of named elements,
     given by a dictionary with keys of 'str' type.
+    Elements can be given as LazyElement objects, which are
+    then only constructed on first access.
     """
 
     def __init__(self, matchfunc=lambda a, b: a == b, elements=None):
@@ -86,6 +123,14 @@ class Registry:
             )
         self._elements[key] = value
 
+    def _resolve(self, key):
+        """ Return the element with the given key, constructing it if it is lazy. """
+        value = self._elements[key]
+        if isinstance(value, LazyElement):
+            value = value.get()
+            self._elements[key] = value
+        return value
+
     def __dir__(self):
         """List of all object keys in the registry"""
         return self._elements.keys()
@@ -95,7 +140,7 @@ class Registry:
 
     def __iter__(self):
         """Iterate over all objects in the registry"""
-        return (w for w in self._elements.values())
+        return (self._resolve(k) for k in list(self._elements.keys()))
 
     def __contains__(self, key):
         """Test wether the given key is defined by the registry."""
@@ -143,10 +188,12 @@ class Registry:
         """
         remove an object from the registry
         """
-        if obj in self._elements.values():
-            return Registry(
-                self._matchfunc, {k: v for k, v in self._elements.items() if v != obj}
-            )
+        remaining = {
+            k: v for k, v in self._elements.items()
+            if (v.peek() if isinstance(v, LazyElement) else v) != obj
+        }
+        if len(remaining) < len(self._elements):
+            return Registry(self._matchfunc, remaining)
         else:
             return self
 
@@ -155,38 +202,51 @@ class Registry:
         Returns True if an element that matches the given specification can be found
         (using find(), thus going beyond the matching of names only as __contains__ does)
         """
-        matches = self.find(spec)
-        return len(matches) > 0
+        return len(self._find_keys(spec)) > 0
 
-    def find(self, spec):
-        """
-        Return a list of items matching the given specification,
-        which could be either the name or a specification that
-        works with the matchfunc of the Glossary.
-        """
+    def _find_keys(self, spec):
+        # keys of the elements matching the given specification
         if isinstance(spec, str) and (spec in self._elements):
-            return [self._elements[spec]]
+            return [spec]
         elif isinstance(spec, int) and (spec < len(self._elements)):
-            return [list(self._elements.values())[spec]]
+            return [list(self._elements.keys())[spec]]
         else:
             # string matching on values
-            matches = [v for v in self._elements.values() if self._matchfunc(v, spec)]
+            matches = [
+                k for k, v in self._elements.items()
+                if (
+                    v.matches(spec) if isinstance(v, LazyElement)
+                    else self._matchfunc(v, spec)
+                )
+            ]
             if len(matches) == 0:
                 # string matching on keys
                 matches = [
-                    self._elements[k]
+                    k
                     for k in self._elements.keys()
                     if all(w.lower() in k.lower() for w in spec.split())
                 ]
             return matches
 
+    def find(self, spec):
+        """
+        Return a list of items matching the given specification,
+        which could be either the name or a specification that
+        works with the matchfunc of the Glossary.
+        """
+        return [self._resolve(k) for k in self._find_keys(spec)]
+
     def __getattr__(self, index):
         """Access elements by using their keys as attributes.
         Keys are auto-generated from the provided names to be uppercase,
         with words delimited using underscores.
         """
+        if index.startswith("_"):
+            # private and special attributes are never registry keys. This also
+            # avoids infinite recursion while unpickling, when _elements is not yet set.
+            raise AttributeError(index)
         if index in self._elements:
-            return self._elements[index]
+            return self._resolve(index)
         else:
             hint = ""
             if isinstance(index, str):
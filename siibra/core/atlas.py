@@ -64,6 +64,10 @@ class Atlas(
             matchfunc=Parcellation.match_spec,
         )
 
+    @classmethod
+    def _index_from_json(cls, obj):
+        return obj.get("@id"), obj.get("name"), None
+
     @classmethod
     def _from_json(cls, obj):
         """
@@ -16,11 +16,13 @@
 from .datasets import Dataset
 
 from .. import QUIET, __version__
-from ..retrieval import GitlabConnector
-from ..commons import logger, Registry
+from ..retrieval import GitlabConnector, CACHE
+from ..retrieval.metrics import METRICS
+from ..commons import logger, Registry, LazyElement
 
 import os
 import re
+import pickle
 
 
 # Until openminds is fully supported, we get configurations of siibra concepts from gitlab.
@@ -29,6 +31,15 @@ GITLAB_PROJECT_TAG = os.getenv(
 )
 USE_DEFAULT_PROJECT_TAG = "SIIBRA_CONFIG_GITLAB_PROJECT_TAG" not in os.environ
 
+# Bootstrapped registries are stored as pickled snapshots in the cache,
+# so subsequent imports do not need to rebuild them from the configuration.
+USE_REGISTRY_SNAPSHOTS = os.getenv("SIIBRA_REGISTRY_SNAPSHOTS", "1") != "0"
+# Increase when the structure of the concept classes changes incompatibly.
+SNAPSHOT_FORMAT = 2
+
+# classes decorated with provide_registry, by class name
+_REGISTRY_CLASSES = {}
+
 
 _BOOTSTRAP_CONNECTORS = (
     # we use an iterator to only instantiate the one[s] used
@@ -37,27 +48,111 @@ _BOOTSTRAP_CONNECTORS = (
         3484,
         GITLAB_PROJECT_TAG,
         skip_branchtest=USE_DEFAULT_PROJECT_TAG,
+        archive_mode=True,
     ),
     GitlabConnector(
         "https://gitlab.ebrains.eu",
         93,
         GITLAB_PROJECT_TAG,
         skip_branchtest=USE_DEFAULT_PROJECT_TAG,
+        archive_mode=True,
     ),
 )
 
 
+class _SnapshotPickler(pickle.Pickler):
+    """
+    Pickles the registry of one concept class. Objects registered
+    by other concept classes are stored by reference, so that they
+    are not duplicated when the snapshot is loaded. The concept classes
+    themselves are stored by name, since snapshots are taken while
+    the classes are still being decorated and not yet bound in their modules.
+    """
+
+    def __init__(self, file, cls):
+        pickle.Pickler.__init__(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.cls = cls
+
+    def persistent_id(self, obj):
+        if isinstance(obj, type):
+            if _REGISTRY_CLASSES.get(obj.__name__) is obj:
+                return (obj.__name__, None)
+            return None
+        objtype = type(obj)
+        if (
+            objtype is not self.cls
+            and _REGISTRY_CLASSES.get(objtype.__name__) is objtype
+            and obj.key in objtype.REGISTRY
+            and objtype.REGISTRY[obj.key] is obj
+        ):
+            return (objtype.__name__, obj.key)
+        return None
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid):
+        clsname, key = pid
+        cls = _REGISTRY_CLASSES[clsname]
+        return cls if key is None else cls.REGISTRY[key]
+
+
+def _snapshot_filename(cls):
+    connector = _BOOTSTRAP_CONNECTORS[0]
+    commit = connector.want_commit
+    ref = GITLAB_PROJECT_TAG if commit is None else commit["id"]
+    return CACHE.build_filename(
+        f"registry-snapshot-{cls.__name__}-{ref}-{__version__}-{SNAPSHOT_FORMAT}"
+        f"-{os.getenv('SIIBRA_URL_MODS', '')}",
+        suffix="pickle",
+    )
+
+
+def _load_snapshot(cls):
+    """
+    Try to set the registry of the class from a previously stored snapshot.
+    Returns True on success.
+    """
+    fname = _snapshot_filename(cls)
+    if not CACHE.available(fname):
+        return False
+    try:
+        with open(fname, "rb") as f:
+            cls.REGISTRY = _SnapshotUnpickler(f).load()
+    except Exception as e:
+        logger.debug(f"Could not load registry snapshot for {cls.__name__}: {e}")
+        return False
+    CACHE.hit(fname)
+    logger.debug(f"Loaded {cls.__name__} registry from snapshot {fname}")
+    return True
+
+
+def _save_snapshot(cls):
+    fname = _snapshot_filename(cls)
+    try:
+        with CACHE.atomic_write(fname) as f:
+            _SnapshotPickler(f, cls).dump(cls.REGISTRY)
+        CACHE.add(fname)
+    except Exception as e:
+        logger.warning(f"Could not store registry snapshot for {cls.__name__}: {e}")
+
+
 def provide_registry(cls):
     """Used for decorating derived classes - will add a registry of bootstrapped instances then."""
 
+    _REGISTRY_CLASSES[cls.__name__] = cls
+    if USE_REGISTRY_SNAPSHOTS and _load_snapshot(cls):
+        return cls
+
     # find a suitable connector that is reachable
     for connector in _BOOTSTRAP_CONNECTORS:
         try:
-            loaders = connector.get_loaders(
-                cls._bootstrap_folder,
-                ".json",
-                progress=f"Bootstrap: {cls.__name__:15.15}",
-            )
+            with METRICS.trigger(f"{cls.__name__} registry"):
+                loaders = connector.get_loaders(
+                    cls._bootstrap_folder,
+                    ".json",
+                    progress=f"Bootstrap: {cls.__name__:15.15}",
+                    prefetch=True,
+                )
             break
         except Exception as e:
             print(str(e))
@@ -71,25 +166,30 @@ def provide_registry(cls):
             f"Cannot initialize atlases: No configuration data found for '{GITLAB_PROJECT_TAG}'."
         )
 
+    # Register lightweight stubs, which construct the actual objects
+    # only when they are accessed for the first time.
     cls.REGISTRY = Registry(matchfunc=cls.match_spec)
+    stubs = []
     extensions = []
-    with QUIET:
-        for fname, loader in loaders:
-            logger.info(f"Loading {fname}")
-            obj = cls._from_json(loader.data)
-            if obj.extends is not None:
-                extensions.append(obj)
-                continue
-            if isinstance(obj, cls):
-                cls.REGISTRY.add(obj.key, obj)
-            else:
-                raise RuntimeError(
-                    f"Could not generate object of type {cls} from configuration {fname} - construction provided type {obj.__class__}"
-                )
+    for fname, loader in loaders:
+        stub = _ConceptStub(cls, loader.data, fname)
+        if stub.extends is not None:
+            extensions.append(stub)
+        else:
+            stubs.append(stub)
+            cls.REGISTRY.add(stub.key, stub)
 
     for e in extensions:
-        target = cls.REGISTRY[e.extends]
-        target._extend(e)
+        targets = [s for s in stubs if s.matches(e.extends)]
+        if len(targets) == 0:
+            raise RuntimeError(
+                f"Configuration {e.fname} extends '{e.extends}', "
+                f"which is not a known {cls.__name__}."
+            )
+        targets[0].extension_specs.append(e.spec)
+
+    if USE_REGISTRY_SNAPSHOTS:
+        _save_snapshot(cls)
 
     return cls
 
@@ -147,6 +247,15 @@ class AtlasConcept:
                 )
                 self._datasets_cached.append(obj)
 
+    @classmethod
+    def _index_from_json(cls, obj):
+        """
+        Extract identifier, name and the identifier of an extended concept
+        (or None) from a json specification without constructing the object.
+        Used for registering concepts lazily, see provide_registry.
+        """
+        return obj.get("@id"), obj.get("shortName", obj.get("name")), obj.get("@extends")
+
     def _extend(self, other):
         """
         Some concepts allow to be extended by refined concepts.
@@ -262,3 +371,37 @@ class AtlasConcept:
     def match_spec(cls, obj, spec):
         assert isinstance(obj, cls)
         return obj.matches(spec)
+
+
+class _ConceptStub(LazyElement):
+    """
+    Registry entry for a bootstrapped atlas concept, which keeps only
+    the json specification until the object is accessed for the first time.
+    Identifier, name and key are extracted upfront for matching.
+    """
+
+    def __init__(self, cls, spec, fname):
+        self.cls = cls
+        self.spec = spec
+        self.fname = fname
+        self.id, self.name, self.extends = cls._index_from_json(spec)
+        self.key = AtlasConcept._create_key(self.name)
+        # specifications of concepts which extend this one
+        self.extension_specs = []
+
+    # match by key, id or name just like the concept itself
+    matches = AtlasConcept.matches
+
+    def build(self):
+        logger.debug(f"Building {self.cls.__name__} '{self.name}' from {self.fname}")
+        with QUIET, METRICS.trigger(f"{self.cls.__name__} registry"):
+            obj = self.cls._from_json(self.spec)
+            if not isinstance(obj, self.cls):
+                raise RuntimeError(
+                    f"Could not generate object of type {self.cls} from configuration {self.fname} - construction provided type {obj.__class__}"
+                )
+            for spec in self.extension_specs:
+                obj._extend(self.cls._from_json(spec))
+        self.spec = None
+        self.extension_specs = []
+        return obj
@@ -133,11 +133,11 @@ class Space(
 SPACEWARP_SERVER = "https://hbp-spatial-backend.apps.hbp.eu/v1"
 
 
-# lookup of space identifiers to be used by SPACEWARP_SERVER
+# lookup of space identifiers to be used by SPACEWARP_SERVER, by space key
 SPACEWARP_IDS = {
-    Space.REGISTRY.MNI152_2009C_NONL_ASYM: "MNI 152 ICBM 2009c Nonlinear Asymmetric",
-    Space.REGISTRY.MNI_COLIN_27: "MNI Colin 27",
-    Space.REGISTRY.BIG_BRAIN: "Big Brain (Histology)",
+    "MNI152_2009C_NONL_ASYM": "MNI 152 ICBM 2009c Nonlinear Asymmetric",
+    "MNI_COLIN_27": "MNI Colin 27",
+    "BIG_BRAIN": "Big Brain (Histology)",
 }
 
 
@@ -354,16 +354,16 @@ class Point(Location):
 
     def warp(self, targetspace: Space):
         """ Creates a new point by warping this point to another space """
-        if not isinstance(targetspace, Space):
+        if targetspace is not None and not isinstance(targetspace, Space):
             targetspace = Space.REGISTRY[targetspace]
-        if any(s not in SPACEWARP_IDS for s in [self.space, targetspace]):
+        if any(s is None or s.key not in SPACEWARP_IDS for s in [self.space, targetspace]):
             raise ValueError(
                 f"Cannot convert coordinates between {self.space} and {targetspace}"
             )
         url = "{server}/transform-point?source_space={src}&target_space={tgt}&x={x}&y={y}&z={z}".format(
             server=SPACEWARP_SERVER,
-            src=quote(SPACEWARP_IDS[Space.REGISTRY[self.space]]),
-            tgt=quote(SPACEWARP_IDS[Space.REGISTRY[targetspace]]),
+            src=quote(SPACEWARP_IDS[self.space.key]),
+            tgt=quote(SPACEWARP_IDS[targetspace.key]),
             x=self.coordinate[0],
             y=self.coordinate[1],
             z=self.coordinate[2],
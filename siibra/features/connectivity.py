@@ -181,7 +181,7 @@ class ConnectivityProfileQuery(FeatureQuery):
 
     def __init__(self, **kwargs):
         FeatureQuery.__init__(self)
-        for _, loader in self._QUERY.get_loaders("connectivity", ".json"):
+        for _, loader in self._QUERY.get_loaders("connectivity", ".json", prefetch=True):
             cm = ConnectivityMatrix._from_json(loader.data)
             for parcellation in cm.parcellations:
                 for regionname in cm.regionnames:
@@ -200,6 +200,6 @@ class ConnectivityMatrixQuery(FeatureQuery):
 
     def __init__(self, **kwargs):
         FeatureQuery.__init__(self)
-        for _, loader in self._CONNECTOR.get_loaders("connectivity", ".json"):
+        for _, loader in self._CONNECTOR.get_loaders("connectivity", ".json", prefetch=True):
             matrix = ConnectivityMatrix._from_json(loader.data)
             self.register(matrix)
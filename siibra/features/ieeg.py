@@ -210,7 +210,9 @@ class IEEG_SessionQuery(FeatureQuery):
             self._CONNECTOR.get_loader("ieeg_contact_points/info.json").data
         )
 
-        for fname, loader in self._CONNECTOR.get_loaders("ieeg_contact_points", ".pts"):
+        for fname, loader in self._CONNECTOR.get_loaders(
+            "ieeg_contact_points", ".pts", prefetch=True
+        ):
 
             logger.debug(f"Retrieving from {fname}")
 
@@ -18,6 +18,7 @@ from .feature import Feature
 from .. import logger
 from ..commons import Registry
 from ..core import AtlasConcept, Dataset
+from ..retrieval.metrics import METRICS
 
 from abc import ABC
 from collections import defaultdict
@@ -78,8 +79,9 @@ class FeatureQuery(ABC):
         for querytype in querytypes:
 
             hits = []
-            for query in FeatureQuery.queries(querytype.modality(), **kwargs):
-                hits.extend(query.execute(concept))
+            with METRICS.trigger(querytype.__name__):
+                for query in FeatureQuery.queries(querytype.modality(), **kwargs):
+                    hits.extend(query.execute(concept))
             matches = list(set(hits))
 
             if group_by is None:
@@ -121,7 +123,8 @@ class FeatureQuery(ABC):
         if (Querytype, args_hash) not in cls._instances:
             logger.debug(f"Building new query {Querytype} with args {kwargs}")
             try:
-                cls._instances[Querytype, args_hash] = Querytype(**kwargs)
+                with METRICS.trigger(Querytype.__name__):
+                    cls._instances[Querytype, args_hash] = Querytype(**kwargs)
             except TypeError as e:
                 logger.error(f"Cannot initialize {Querytype} query: {str(e)}")
                 raise (e)
@@ -66,6 +66,6 @@ class VolumeOfInterestQuery(FeatureQuery):
 
     def __init__(self, **kwargs):
         FeatureQuery.__init__(self)
-        for _, loader in self._QUERY.get_loaders(folder="vois", suffix=".json"):
+        for _, loader in self._QUERY.get_loaders(folder="vois", suffix=".json", prefetch=True):
             voi = VolumeOfInterest._from_json(loader.data)  # json.loads(data))
             self.register(voi)
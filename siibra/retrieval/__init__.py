@@ -16,3 +16,5 @@
 from .repositories import GitlabConnector, OwncloudConnector
 from .requests import HttpRequest, LazyHttpRequest, ZipfileRequest, EbrainsRequest
 from .cache import CACHE
+from .manifest import Manifest
+from .metrics import stats
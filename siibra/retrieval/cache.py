@@ -17,9 +17,86 @@ import hashlib
 import os
 from appdirs import user_cache_dir
 import tempfile
+import sqlite3
+import threading
+import atexit
+import time
+import re
+import uuid
+import sys
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from nibabel import Nifti1Image
+
+try:
+    import fcntl
+except ImportError:
+    # not available on windows, where msvcrt is used instead
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
 
 from ..commons import logger
 
+# name of the sqlite file which keeps track of cached files inside the cache folder
+INDEX_FILENAME = "siibra-cache-index.sqlite"
+
+# subfolder of the cache folder holding the lock files of cache entries
+LOCK_FOLDER = "locks"
+# Cache entries are locked by a fixed number of lock files, selected by
+# the hash of the entry's name, so that lock files do not accumulate.
+LOCK_SLOTS = 256
+
+# suffix of temporary files, which are renamed to the cache entry when complete
+PARTIAL_SUFFIX = ".part"
+# seconds after their last modification when temporary files are considered left
+# behind by interrupted downloads, and removed (downloads are resumed until then)
+PARTIAL_MAXAGE = 24 * 3600
+# file in the cache folder whose modification time tells when
+# the cache folder was last scanned for such temporary files
+PARTIALS_STAMP = "siibra-partials-removed"
+
+# Buffered cache hits are written to the index after this many seconds,
+# or as soon as this many entries have pending hits, so that other processes
+# sharing the cache folder see the access times of long-running ones.
+HIT_FLUSH_INTERVAL = 60
+HIT_FLUSH_COUNT = 1000
+
+# supported eviction policies: least recently used, least frequently used
+EVICTION_POLICIES = ["lru", "lfu"]
+
+
+# Threads of this process are synchronized by one reentrant lock per slot,
+# processes by locking the slot's lock file.
+_SLOT_LOCKS = [threading.RLock() for _ in range(LOCK_SLOTS)]
+_slot_depth = [0] * LOCK_SLOTS
+
+
+def _lock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+    elif msvcrt is not None:
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after 10 seconds
+                continue
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+    elif msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
 def assert_folder(folder):
     # make sure the folder exists and is writable, then return it.
     # If it cannot be written, create and return
@@ -42,10 +119,207 @@ def assert_folder(folder):
         return tmpdir
 
 
+def parse_bytesize(spec):
+    """
+    Parse a byte size specification like "500000", "200M" or "2.5G"
+    into a number of bytes.
+    """
+    match = re.match(r"^\s*([0-9.]+)\s*([kmgt]?)i?b?\s*$", str(spec).lower())
+    if match is None:
+        raise ValueError(f"Cannot interpret '{spec}' as a byte size.")
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmgt".index(unit or " "))
+
+
+class CacheIndex:
+    """
+    Bookkeeping of the files in a cache folder, recording their size,
+    time of last access, number of hits and originating URL.
+    The index is stored in an sqlite database inside the cache folder,
+    so it is shared by all processes using the same folder.
+    Cache hits are only buffered in memory and written in batches
+    (see HIT_FLUSH_INTERVAL and HIT_FLUSH_COUNT), to keep the overhead
+    of cache lookups low.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.dbfile = os.path.join(folder, INDEX_FILENAME)
+        self._lock = threading.RLock()
+        self._pending_hits = {}
+        self._flush_timer = None
+        self._connect()
+
+    def _connect(self):
+        is_new = not os.path.isfile(self.dbfile)
+        try:
+            self._db = self._open()
+        except sqlite3.DatabaseError as e:
+            logger.warning(f"Cache index {self.dbfile} is corrupt ({e}), rebuilding it.")
+            os.remove(self.dbfile)
+            is_new = True
+            self._db = self._open()
+        if is_new:
+            self.scan()
+
+    def _open(self):
+        db = sqlite3.connect(self.dbfile, timeout=60, check_same_thread=False)
+        db.execute("PRAGMA synchronous=OFF")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "filename TEXT PRIMARY KEY, url TEXT, size INTEGER, "
+            "accessed REAL, hits INTEGER)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS validators ("
+            "filename TEXT PRIMARY KEY, etag TEXT, modified TEXT, checked REAL)"
+        )
+        db.commit()
+        return db
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    def scan(self):
+        """
+        Register files which are in the cache folder, but not yet in the index
+        (e.g. because they were written by an older version of siibra).
+        """
+        with self._lock:
+            known = {r[0] for r in self._db.execute("SELECT filename FROM entries")}
+            rows = []
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and not entry.name.startswith(INDEX_FILENAME) \
+                        and not entry.name.endswith(PARTIAL_SUFFIX) \
+                        and entry.name not in known:
+                    # links to shared cache folders do not occupy space in this folder
+                    stat = entry.stat(follow_symlinks=False)
+                    rows.append((entry.name, None, stat.st_size, stat.st_mtime, 0))
+            self._db.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?,?,?,?,?)", rows
+            )
+            self._db.commit()
+            if len(rows) > 0:
+                logger.debug(f"Registered {len(rows)} unindexed files in {self.folder}")
+
+    def add(self, filename, url=None):
+        """ Register a newly written cache file. """
+        name = os.path.basename(filename)
+        size = os.lstat(os.path.join(self.folder, name)).st_size
+        with self._lock:
+            self._pending_hits.pop(name, None)
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?)",
+                (name, url, size, time.time(), 1)
+            )
+            self._db.commit()
+
+    def hit(self, filename):
+        """ Record a cache hit. The index is updated at the next flush. """
+        name = os.path.basename(filename)
+        with self._lock:
+            _, count = self._pending_hits.get(name, (None, 0))
+            self._pending_hits[name] = (time.time(), count + 1)
+            if len(self._pending_hits) >= HIT_FLUSH_COUNT:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(HIT_FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def flush(self):
+        """ Write buffered cache hits to the index. """
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if len(self._pending_hits) == 0:
+                return
+            for name, (accessed, count) in self._pending_hits.items():
+                cursor = self._db.execute(
+                    "UPDATE entries SET accessed=?, hits=hits+? WHERE filename=?",
+                    (accessed, count, name)
+                )
+                if cursor.rowcount == 0:
+                    path = os.path.join(self.folder, name)
+                    if os.path.isfile(path):
+                        self._db.execute(
+                            "INSERT OR IGNORE INTO entries VALUES (?,?,?,?,?)",
+                            (name, None, os.lstat(path).st_size, accessed, count)
+                        )
+            self._db.commit()
+            self._pending_hits.clear()
+
+    def remove(self, filename):
+        name = os.path.basename(filename)
+        with self._lock:
+            self._pending_hits.pop(name, None)
+            self._db.execute("DELETE FROM entries WHERE filename=?", (name,))
+            self._db.execute("DELETE FROM validators WHERE filename=?", (name,))
+            self._db.commit()
+
+    def set_validator(self, filename, etag=None, modified=None):
+        """
+        Store the http validators (ETag and Last-Modified header) of a cache file,
+        and record that its content was just checked to be up to date.
+        """
+        name = os.path.basename(filename)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO validators VALUES (?,?,?,?)",
+                (name, etag, modified, time.time())
+            )
+            self._db.commit()
+
+    def validator(self, filename):
+        """
+        Returns the tuple (etag, modified, checked) stored for a cache file, or None.
+        """
+        name = os.path.basename(filename)
+        with self._lock:
+            return self._db.execute(
+                "SELECT etag, modified, checked FROM validators WHERE filename=?", (name,)
+            ).fetchone()
+
+    @property
+    def size(self):
+        """ Total number of bytes of the indexed cache files. """
+        with self._lock:
+            return int(self._db.execute("SELECT TOTAL(size) FROM entries").fetchone()[0])
+
+    def candidates(self, policy="lru"):
+        """
+        Iterate over (filename, size) of indexed files,
+        in the order in which they should be evicted.
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(
+                f"Unknown cache eviction policy '{policy}', "
+                f"use one of {', '.join(EVICTION_POLICIES)}."
+            )
+        order = "accessed" if policy == "lru" else "hits, accessed"
+        self.flush()
+        with self._lock:
+            return self._db.execute(
+                f"SELECT filename, size FROM entries ORDER BY {order}"
+            ).fetchall()
+
+
 class Cache:
 
     _instance = None
     folder = user_cache_dir(".".join(__name__.split(".")[:-1]), "")
+    # maximum number of bytes to keep in the cache, None for no limit
+    maxbytes = None
+    policy = "lru"
+    # Read-only cache folders, searched in order for entries which are
+    # not in the (writable) cache folder, e.g. a pre-warmed site-wide cache.
+    shared_folders = []
+    # Wether entries found in a shared folder are copied to the cache folder.
+    # If False, they are linked instead.
+    promote = False
 
     def __init__(self):
         raise RuntimeError(
@@ -61,25 +335,334 @@ class Cache:
             if "SIIBRA_CACHEDIR" in os.environ:
                 cls.folder = os.environ["SIIBRA_CACHEDIR"]
             cls.folder = assert_folder(cls.folder)
+            if "SIIBRA_CACHE_MAXBYTES" in os.environ:
+                cls.maxbytes = parse_bytesize(os.environ["SIIBRA_CACHE_MAXBYTES"])
+            cls.policy = os.environ.get("SIIBRA_CACHE_POLICY", cls.policy).lower()
+            if "SIIBRA_SHARED_CACHEDIRS" in os.environ:
+                cls.shared_folders = [
+                    f for f in os.environ["SIIBRA_SHARED_CACHEDIRS"].split(os.pathsep)
+                    if len(f) > 0 and os.path.abspath(f) != os.path.abspath(cls.folder)
+                ]
+                for f in cls.shared_folders:
+                    if not os.path.isdir(f):
+                        logger.warning(f"Shared cache folder {f} does not exist.")
+            cls.promote = os.environ.get("SIIBRA_CACHE_PROMOTE", "0").lower() in ["1", "true", "yes", "on"]
             cls._instance = cls.__new__(cls)
+            cls._instance.index = CacheIndex(cls.folder)
+            cls._instance._remove_partials_if_due()
+            atexit.register(cls._instance.index.flush)
         return cls._instance
 
     def clear(self):
         import shutil
 
         logger.info(f"Clearing siibra cache at {self.folder}")
+        self.index.close()
         shutil.rmtree(self.folder)
         self.folder = assert_folder(self.folder)
+        self.index = CacheIndex(self.folder)
+
+    @contextmanager
+    def lock(self, filename):
+        """
+        Context manager which holds an exclusive lock for the given cache file,
+        shared across threads and processes using the same cache folder.
+        Use it to make sure that only one process creates a cache entry,
+        while the others wait and then reuse it.
+        """
+        slot = int(hashlib.md5(os.path.basename(filename).encode()).hexdigest(), 16) % LOCK_SLOTS
+        with _SLOT_LOCKS[slot]:
+            if _slot_depth[slot] > 0:
+                # the slot is held by this thread already, e.g. when extracting
+                # an archive member requires retrieving the archive
+                yield
+                return
+            lockfolder = os.path.join(self.folder, LOCK_FOLDER)
+            os.makedirs(lockfolder, exist_ok=True)
+            lockfile = os.path.join(lockfolder, f"{slot:03d}.lock")
+            _slot_depth[slot] += 1
+            try:
+                with open(lockfile, "a+") as f:
+                    _lock_file(f)
+                    try:
+                        yield
+                    finally:
+                        _unlock_file(f)
+            finally:
+                _slot_depth[slot] -= 1
+
+    @contextmanager
+    def atomic_write(self, filename, mode="wb"):
+        """
+        Context manager providing a file object for writing a cache file.
+        The content is written to a temporary file, which replaces the
+        cache file only after it was completely written. Readers
+        therefore never see partially written cache files.
+        """
+        tmpname = f"{filename}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+        try:
+            with open(tmpname, mode.replace("w", "x")) as f:
+                yield f
+            os.replace(tmpname, filename)
+        except BaseException:
+            if os.path.isfile(tmpname):
+                os.remove(tmpname)
+            raise
+
+    def remove_partials(self, maxage=PARTIAL_MAXAGE):
+        """
+        Remove temporary files of downloads and writes which were
+        interrupted, and not continued for the given number of seconds.
+        They are not part of the index, so they are never evicted.
+
+        Returns
+        -------
+        Number of bytes freed.
+        """
+        freed = 0
+        now = time.time()
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith(PARTIAL_SUFFIX) or not entry.is_file():
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > maxage:
+                try:
+                    os.remove(entry.path)
+                    freed += stat.st_size
+                except FileNotFoundError:
+                    pass
+        if freed > 0:
+            logger.debug(f"Removed {freed} bytes of interrupted downloads from {self.folder}")
+        stamp = os.path.join(self.folder, PARTIALS_STAMP)
+        with open(stamp, "a"):
+            os.utime(stamp)
+        return freed
+
+    def _remove_partials_if_due(self):
+        # Scanning the cache folder is expensive, so it is done
+        # at most once within PARTIAL_MAXAGE when the cache is opened.
+        stamp = os.path.join(self.folder, PARTIALS_STAMP)
+        if os.path.isfile(stamp) and time.time() - os.path.getmtime(stamp) < PARTIAL_MAXAGE:
+            return 0
+        return self.remove_partials()
+
+    @property
+    def size(self):
+        """ Number of bytes currently used by the cache. """
+        return self.index.size
+
+    def add(self, filename, url=None):
+        """
+        Register a file that was just written to the cache,
+        and evict old files if the cache exceeds its size limit.
+
+        Parameters
+        ----------
+        filename : str
+            The cache file, as returned by build_filename()
+        url : str, default: None
+            The URL from where the content was retrieved, if any.
+        """
+        self.index.add(filename, url)
+        if self.maxbytes is not None:
+            self.evict(self.maxbytes, keep=[filename])
+
+    def hit(self, filename):
+        """ Notify the cache that an existing cache file is being reused. """
+        self.index.hit(filename)
+
+    def evict(self, maxbytes=None, keep=[]):
+        """
+        Remove cache files until the cache size is below the given limit,
+        following the eviction policy of the cache (SIIBRA_CACHE_POLICY,
+        "lru" for least recently used, or "lfu" for least frequently used).
+
+        Parameters
+        ----------
+        maxbytes : int, default: None
+            Size limit in bytes. If None, the configured limit (SIIBRA_CACHE_MAXBYTES) is used.
+        keep : list of str
+            Cache files which should not be removed.
+
+        Returns
+        -------
+        Number of bytes freed.
+        """
+        if maxbytes is None:
+            maxbytes = self.maxbytes
+        if maxbytes is None:
+            return 0
+        excess = self.size - maxbytes
+        if excess <= 0:
+            return 0
+        self.remove_partials()
+        keepnames = {os.path.basename(f) for f in keep}
+        freed = 0
+        for name, size in self.index.candidates(self.policy):
+            if freed >= excess:
+                break
+            if name in keepnames:
+                continue
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                pass
+            self.index.remove(name)
+            freed += size
+        logger.debug(f"Evicted {freed} bytes from siibra cache at {self.folder}")
+        return freed
 
     def build_filename(self, str_rep, suffix=None):
         hashfile = os.path.join(
             self.folder,
             str(hashlib.sha256(str_rep.encode("ascii")).hexdigest())
         )
-        if suffix is None:
-            return hashfile
-        else:
-            return hashfile + "." + suffix
+        return hashfile if suffix is None else hashfile + "." + suffix
+
+    def _shared_entry(self, filename):
+        # the file of a shared cache folder which provides the given cache file, if any
+        name = os.path.basename(filename)
+        for folder in self.shared_folders:
+            source = os.path.join(folder, name)
+            if os.path.isfile(source):
+                return source
+        return None
+
+    def exists(self, filename):
+        """
+        Wether the given cache file exists in the cache folder or in a shared cache folder.
+        """
+        return os.path.isfile(filename) or self._shared_entry(filename) is not None
+
+    def available(self, filename):
+        """
+        Wether the given cache file can be read. If it is only found in a
+        shared cache folder, it is linked into the cache folder, or copied
+        if the cache promotes shared entries (SIIBRA_CACHE_PROMOTE). Call
+        this right before reading the file, so that only entries which are
+        actually used are promoted. Since a link is replaced when the cache
+        file is written, writes never go to the shared folder.
+        """
+        if os.path.lexists(filename):
+            return os.path.isfile(filename)
+        source = self._shared_entry(filename)
+        if source is None:
+            return False
+        if not self.promote:
+            try:
+                os.symlink(source, filename)
+                self.add(filename)
+                return True
+            except FileExistsError:
+                # provided by another process meanwhile
+                return os.path.isfile(filename)
+            except OSError:
+                # links are not supported, copy the entry instead
+                pass
+        import shutil
+        with self.lock(filename):
+            if os.path.lexists(filename):
+                return os.path.isfile(filename)
+            logger.debug(f"Copying {os.path.basename(filename)} from shared cache folder {os.path.dirname(source)}")
+            with open(source, "rb") as src, self.atomic_write(filename) as dst:
+                shutil.copyfileobj(src, dst)
+        self.add(filename)
+        return True
+
+
+def estimate_nbytes(obj):
+    """
+    Estimate the number of bytes of memory occupied by a decoded object.
+    Exact for numpy arrays, approximate for images and json-like structures.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, Nifti1Image):
+        nbytes = 0
+        if isinstance(obj.dataobj, np.ndarray):
+            nbytes += obj.dataobj.nbytes
+        fdata = getattr(obj, "_fdata_cache", None)
+        if fdata is not None:
+            nbytes += fdata.nbytes
+        return nbytes + sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_nbytes(k) + estimate_nbytes(v) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set)):
+        return sys.getsizeof(obj) + sum(estimate_nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class MemoryCache:
+    """
+    Size-bounded in-memory cache for decoded objects, such as images or
+    json structures produced by lazy loaders. When the total estimated size
+    exceeds the budget (SIIBRA_MEMCACHE_MAXBYTES), the least recently
+    used objects are dropped. Loaders then decode them again from the disk cache.
+    """
+
+    def __init__(self, maxbytes):
+        self.maxbytes = maxbytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+
+    def get(self, key):
+        """ Return the object stored under key, or None. """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            obj, nbytes = self._entries[key]
+            self._entries.move_to_end(key)
+            if isinstance(obj, Nifti1Image):
+                # images may have grown by caching their data arrays
+                new_nbytes = estimate_nbytes(obj)
+                self._entries[key] = (obj, new_nbytes)
+                self.nbytes += new_nbytes - nbytes
+                self._shrink(keep=key)
+            return obj
+
+    def put(self, key, obj):
+        """
+        Store an object, possibly dropping least recently used ones.
+        Returns False if the object exceeds the budget and was not stored.
+        """
+        nbytes = estimate_nbytes(obj)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            if self.maxbytes is not None and nbytes > self.maxbytes:
+                logger.warning(
+                    f"Object of {nbytes} bytes exceeds the memory cache size of {self.maxbytes} "
+                    "bytes (SIIBRA_MEMCACHE_MAXBYTES), it is only kept by its loader."
+                )
+                return False
+            self._entries[key] = (obj, nbytes)
+            self.nbytes += nbytes
+            self._shrink(keep=key)
+            return True
+
+    def _shrink(self, keep=None):
+        if self.maxbytes is None:
+            return
+        for key in list(self._entries.keys()):
+            if self.nbytes <= self.maxbytes:
+                break
+            if key == keep:
+                continue
+            self.nbytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
 
 
 CACHE = Cache.instance()
+MEMCACHE = MemoryCache(
+    parse_bytesize(os.environ.get("SIIBRA_MEMCACHE_MAXBYTES", "2G"))
+)
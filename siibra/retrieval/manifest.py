@@ -0,0 +1,250 @@
+# Copyright 2018-2021
+# Institute of Neuroscience and Medicine (INM-1), Forschungszentrum Jülich GmbH
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .cache import CACHE
+from . import requests
+from .requests import HttpRequest, NiftiHeaderRequest, HttpRangeRequest, EbrainsRequest
+from ..commons import logger
+
+import atexit
+import json
+import os
+import sys
+import threading
+import numpy as np
+
+
+class Manifest:
+    """
+    List of URLs whose content needs to be available in the cache,
+    for example to run siibra in offline mode (SIIBRA_OFFLINE).
+    Each entry records the URL and the name of its cache file.
+    Content which is not retrieved by a plain http request, like
+    range requests, knowledge graph queries or neuroglancer cutouts,
+    is listed separately in 'requests' by the name of its cache file,
+    with the information needed to repeat the request.
+    """
+
+    def __init__(self, tag=None, entries=None, requests=None):
+        self.tag = tag
+        self.entries = {} if entries is None else dict(entries)
+        self.requests = {} if requests is None else dict(requests)
+        self._lock = threading.Lock()
+
+    def add(self, url, cachefile=None):
+        """
+        Add a URL to the manifest. If the cache file is not given,
+        it is determined as for a plain HttpRequest of the URL.
+        """
+        if cachefile is None:
+            cachefile = HttpRequest(url).cachefile
+        self.entries[url] = os.path.basename(cachefile)
+
+    def record(self, loader):
+        """
+        Add the request of a loader to the manifest.
+        Authorization headers are not recorded.
+        """
+        fname = os.path.basename(loader.cachefile)
+        if isinstance(loader, NiftiHeaderRequest):
+            spec = {"url": loader.url, "kind": "header"}
+        elif isinstance(loader, HttpRangeRequest):
+            spec = {"url": loader.url, "kind": "range", "start": loader.start, "stop": loader.stop}
+        elif isinstance(loader, EbrainsRequest):
+            spec = {"url": loader.url, "kind": "ebrains", "params": loader.params}
+        elif len(loader.kwargs) == 0:
+            with self._lock:
+                self.entries[loader.url] = fname
+            return
+        else:
+            kwargs = dict(loader.kwargs)
+            if "headers" in kwargs:
+                kwargs["headers"] = {
+                    k: v for k, v in kwargs["headers"].items() if k.lower() != "authorization"
+                }
+            spec = {"url": loader.url, "kind": "http", "kwargs": kwargs}
+        with self._lock:
+            self.requests[fname] = spec
+
+    def record_cutout(self, url, bbox, mip, cachefile):
+        """
+        Add a cutout of a neuroglancer volume, given by its bounding box
+        (as serialized by cloudvolume) and mip level, to the manifest.
+        """
+        with self._lock:
+            self.requests[os.path.basename(cachefile)] = {
+                "url": url, "kind": "neuroglancer", "bbox": bbox, "mip": mip
+            }
+
+    def __len__(self):
+        return len(self.entries) + len(self.requests)
+
+    def missing(self, folder=None):
+        """
+        Returns the URLs of the manifest which are not available
+        in the given cache folder (default: the siibra cache,
+        including its shared cache folders).
+        """
+        return [spec["url"] for _, spec in self._missing(folder)]
+
+    def _missing(self, folder=None):
+        # (cache file name, request spec) of all missing entries
+        folders = [CACHE.folder] + CACHE.shared_folders if folder is None else [folder]
+        specs = [(fname, {"url": url, "kind": "http"}) for url, fname in self.entries.items()]
+        specs.extend(self.requests.items())
+        return [
+            (fname, spec) for fname, spec in specs
+            if not any(os.path.isfile(os.path.join(f, fname)) for f in folders)
+        ]
+
+    def replay(self, max_workers=None):
+        """
+        Retrieve all missing entries of the manifest into the cache,
+        using a bounded number of concurrent downloads
+        (default: SIIBRA_PREFETCH_WORKERS). Entries which cannot be
+        retrieved are logged and skipped.
+
+        Returns
+        -------
+        Number of retrieved entries, and the list of URLs which failed.
+        """
+        missing = self._missing()
+        loaders = []
+        # cutouts of the same volume and mip are retrieved together
+        cutouts = {}
+        for fname, spec in missing:
+            cachefile = os.path.join(CACHE.folder, fname)
+            if spec["kind"] == "neuroglancer":
+                cutouts.setdefault((spec["url"], spec["mip"]), []).append((spec["bbox"], cachefile))
+                continue
+            if spec["kind"] == "header":
+                loader = NiftiHeaderRequest(spec["url"])
+            elif spec["kind"] == "range":
+                loader = HttpRangeRequest(spec["url"], spec["start"], spec["stop"])
+            elif spec["kind"] == "ebrains":
+                loader = EbrainsRequest.from_url(spec["url"], spec["params"])
+            else:
+                loader = HttpRequest(spec["url"], **spec.get("kwargs", {}))
+            loader.cachefile = cachefile
+            loaders.append(loader)
+        loaders.extend(_CutoutRequest(url, mip, c) for (url, mip), c in cutouts.items())
+        logger.info(f"Retrieving {len(missing)} of {len(self)} manifest entries into {CACHE.folder}.")
+        failed = requests.prefetch(
+            loaders, max_workers=max_workers, desc="Replay", decode=False, raise_errors=False
+        )
+        # a failed cutout request comprises all of its chunks
+        nfailed = sum(
+            len(loader.cutouts) if isinstance(loader, _CutoutRequest) else 1 for loader, _ in failed
+        )
+        return len(missing) - nfailed, [loader.url for loader, _ in failed]
+
+    def save(self, filename):
+        with self._lock:
+            spec = {"tag": self.tag, "entries": self.entries, "requests": self.requests}
+            with open(filename, "w") as f:
+                json.dump(spec, f, indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as f:
+            spec = json.load(f)
+        return cls(spec.get("tag"), spec["entries"], spec.get("requests"))
+
+
+class _CutoutRequest:
+    # Retrieves the recorded chunks of a neuroglancer volume at one mip
+    # into the cache, the same way as NeuroglancerVolume does when fetching them,
+    # using a single volume for all chunks.
+
+    def __init__(self, url, mip, cutouts):
+        self.url = url
+        self.mip = mip
+        # (serialized bounding box, cache file) of each chunk
+        self.cutouts = cutouts
+
+    def _retrieve(self):
+        from ..volumes import NeuroglancerVolume
+        from cloudvolume import Bbox
+        volume = NeuroglancerVolume(self.url, self.url, self.url, None)
+        chunks = []
+        for bbox, cachefile in self.cutouts:
+            bbox = Bbox.deserialize(bbox)
+            chunks.append((np.array(bbox.minpt, dtype=int), np.array(bbox.maxpt, dtype=int), cachefile))
+        volume._retrieve_chunks(self.mip, chunks)
+
+
+def start_recording(filename):
+    """
+    Record the content retrieved by siibra in a manifest, which is written
+    to the given file at exit. Replaying the manifest (see Manifest.replay)
+    retrieves the same content into another cache, e.g. to pre-warm it
+    for a recorded workload. Recording is started automatically
+    if SIIBRA_RECORD_MANIFEST is set to a filename.
+    """
+    if requests.RECORDER is None:
+        requests.RECORDER = Manifest()
+
+    def save():
+        # tag of the configuration in use, if it was loaded
+        concept = sys.modules.get(f"{__name__.split('.')[0]}.core.concept")
+        if concept is not None:
+            requests.RECORDER.tag = concept.GITLAB_PROJECT_TAG
+        logger.info(f"Writing manifest of {len(requests.RECORDER)} retrieved entries to {filename}")
+        requests.RECORDER.save(filename)
+
+    atexit.register(save)
+
+
+if "SIIBRA_RECORD_MANIFEST" in os.environ:
+    start_recording(os.environ["SIIBRA_RECORD_MANIFEST"])
+
+
+def build_config_manifest():
+    """
+    Build the manifest of URLs needed by the current configuration
+    (SIIBRA_CONFIG_GITLAB_PROJECT_TAG): the bootstrap data of the
+    configuration repository, and all image volumes referenced by
+    spaces, parcellations and their regions. For neuroglancer volumes,
+    only the info file is included, since image chunks are requested on demand.
+    Note that this builds all atlas concepts, which requires network access.
+    """
+    from ..core import concept, Space, Parcellation, Atlas
+    from ..volumes import NeuroglancerVolume, RemoteNiftiVolume
+
+    manifest = Manifest(tag=concept.GITLAB_PROJECT_TAG)
+
+    connector = concept._BOOTSTRAP_CONNECTORS[0]
+    if connector.want_commit is not None:
+        manifest.add(connector._branchloader.url, connector._branchloader.cachefile)
+    for cls in [Space, Parcellation, Atlas]:
+        if not connector.archive_mode:
+            for loader in connector._tree_loaders(cls._bootstrap_folder):
+                manifest.add(loader.url, loader.cachefile)
+        for _, loader in connector.get_loaders(cls._bootstrap_folder, ".json"):
+            manifest.add(loader.url, loader.cachefile)
+
+    concepts = list(Space.REGISTRY) + list(Atlas.REGISTRY)
+    for parcellation in Parcellation.REGISTRY:
+        concepts.extend(parcellation.regiontree.descendants)
+        concepts.append(parcellation)
+    for obj in concepts:
+        for volume in obj.volumes:
+            if isinstance(volume, NeuroglancerVolume):
+                manifest.add(volume.url + "/info")
+            elif isinstance(volume, RemoteNiftiVolume):
+                manifest.add(volume.url)
+
+    logger.info(f"Manifest of configuration {manifest.tag} lists {len(manifest)} URLs.")
+    return manifest
@@ -0,0 +1,136 @@
+# Copyright 2018-2021
+# Institute of Neuroscience and Medicine (INM-1), Forschungszentrum Jülich GmbH
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ..commons import logger
+
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import atexit
+import bisect
+import json
+import os
+import threading
+
+# upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = [0.01, 0.1, 1.0, 10.0, 100.0]
+
+
+class Metrics:
+    """
+    Counters and timings of data retrieval in the running process:
+    - hits and misses per cache layer ("memory" for decoded objects,
+      "disk" for the file cache),
+    - number of bytes downloaded per host (for neuroglancer volumes,
+      the size of the decoded image data),
+    - histograms of download and decoding latencies,
+    - number of downloads and bytes per trigger, i.e. the registry or
+      feature query which caused them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._hits = defaultdict(int)
+            self._misses = defaultdict(int)
+            self._host_bytes = defaultdict(int)
+            self._latencies = {
+                kind: [0] * (len(LATENCY_BUCKETS) + 1) for kind in ["download", "decode"]
+            }
+            self._triggers = defaultdict(lambda: {"downloads": 0, "bytes": 0})
+
+    @property
+    def current_trigger(self):
+        """ Name of the innermost trigger of the current thread, if any. """
+        triggers = getattr(self._local, "triggers", [])
+        return triggers[-1] if len(triggers) > 0 else None
+
+    @contextmanager
+    def trigger(self, name):
+        """
+        Context manager which attributes the downloads
+        of the current thread to the given name.
+        """
+        if not hasattr(self._local, "triggers"):
+            self._local.triggers = []
+        self._local.triggers.append(name)
+        try:
+            yield
+        finally:
+            self._local.triggers.pop()
+
+    def hit(self, layer):
+        with self._lock:
+            self._hits[layer] += 1
+
+    def miss(self, layer):
+        with self._lock:
+            self._misses[layer] += 1
+
+    def _observe(self, kind, seconds):
+        self._latencies[kind][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def download(self, url, nbytes, seconds):
+        """ Record a completed download. """
+        trigger = self.current_trigger or "other"
+        with self._lock:
+            self._host_bytes[urlsplit(url).netloc] += nbytes
+            self._observe("download", seconds)
+            self._triggers[trigger]["downloads"] += 1
+            self._triggers[trigger]["bytes"] += nbytes
+
+    def decode(self, seconds):
+        """ Record the decoding of retrieved data. """
+        with self._lock:
+            self._observe("decode", seconds)
+
+    def as_dict(self):
+        labels = [f"<={b}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        with self._lock:
+            return {
+                "hits": dict(self._hits),
+                "misses": dict(self._misses),
+                "bytes_per_host": dict(self._host_bytes),
+                "latencies": {
+                    kind: dict(zip(labels, counts))
+                    for kind, counts in self._latencies.items()
+                },
+                "triggers": {k: dict(v) for k, v in self._triggers.items()},
+            }
+
+    def dump(self, filename):
+        logger.info(f"Writing retrieval statistics to {filename}")
+        with open(filename, "w") as f:
+            json.dump(self.as_dict(), f, indent=1)
+
+
+METRICS = Metrics()
+
+# If SIIBRA_STATS_FILE is set, the statistics are written to this file at exit.
+if "SIIBRA_STATS_FILE" in os.environ:
+    atexit.register(METRICS.dump, os.environ["SIIBRA_STATS_FILE"])
+
+
+def stats():
+    """
+    Returns the data retrieval statistics of the running process as a dictionary
+    with cache hits and misses per layer, downloaded bytes per host, latency
+    histograms of downloads and decoding, and downloads per trigger.
+    """
+    return METRICS.as_dict()
@@ -13,13 +13,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .requests import DECODERS, LazyHttpRequest
+from .requests import (
+    DECODERS,
+    decode_identity,
+    HttpRequest,
+    LazyHttpRequest,
+    ZipfileRequest,
+    prefetch as prefetch_loaders,
+)
 from .. import logger
 from abc import ABC, abstractmethod
 from urllib.parse import quote
+from zipfile import ZipFile
 import base64
 from tqdm import tqdm
 import json
+import os
+
+# Seconds for which the cached branch list of a gitlab project is used without
+# revalidating it. Files of branches are requested by commit id, so the branch
+# list decides wether they are up to date.
+BRANCH_TTL = float(os.getenv("SIIBRA_BRANCH_TTL", 0))
+
+
+def _suffix_decoder(filename):
+    # the module-level decoder of RepositoryConnector._decode_response for a file name,
+    # so that loaders using it can be pickled and share their single-flight key
+    for sfx, dec in DECODERS.items():
+        if filename.endswith(sfx):
+            return dec
+    return decode_identity
 
 
 class RepositoryConnector(ABC):
@@ -65,17 +88,35 @@ class RepositoryConnector(ABC):
             return LazyHttpRequest(self._build_url(folder, filename), decode_func)
 
     def get_loaders(
-        self, folder="", suffix=None, progress=None, recursive=False, decode_func=None
+        self,
+        folder="",
+        suffix=None,
+        progress=None,
+        recursive=False,
+        decode_func=None,
+        prefetch=False,
+        max_workers=None,
     ):
         """
         Returns an iterator with lazy loaders for the files in a given folder.
         In each iteration, a tuple (filename,file content) is returned.
+
+        If prefetch is True, the files are downloaded and decoded concurrently
+        by a pool of at most max_workers threads before returning, so that
+        the returned loaders already hold their data.
         """
         fnames = self.search_files(folder, suffix, recursive)
         result = [
             (fname, self.get_loader(fname, decode_func=decode_func)) for fname in fnames
         ]
         all_cached = all(_[1].cached for _ in result)
+        if prefetch:
+            prefetch_loaders(
+                [loader for _, loader in result],
+                max_workers=max_workers,
+                desc=None if all_cached else progress,
+            )
+            return result
         if progress is None or all_cached:
             return result
         else:
@@ -83,7 +124,33 @@ class RepositoryConnector(ABC):
 
 
 class GitlabConnector(RepositoryConnector):
-    def __init__(self, server: str, project: int, reftag: str, skip_branchtest=False):
+    def __init__(
+        self,
+        server: str,
+        project: int,
+        reftag: str,
+        skip_branchtest=False,
+        archive_mode=False,
+    ):
+        """
+        Connect to a project of a gitlab server.
+
+        Parameters
+        ----------
+        server : str
+            Base url of the gitlab server
+        project : int
+            Id of the gitlab project
+        reftag : str
+            Tag, branch or commit to use
+        skip_branchtest : bool, default: False
+            If True, the reftag is assumed not to be a branch.
+        archive_mode : bool, default: False
+            If True, the repository is downloaded once as a zip archive,
+            and all files are served from this archive instead of requesting
+            them one by one. If the archive cannot be retrieved, the connector
+            falls back to requesting individual files.
+        """
         # TODO: the query builder needs to check wether the reftag is a branch, and then not cache.
         assert server.startswith("http")
         RepositoryConnector.__init__(
@@ -92,10 +159,12 @@ class GitlabConnector(RepositoryConnector):
         self.reftag = reftag
         self._per_page = 100
         self._branchloader = LazyHttpRequest(
-            f"{self.base_url}/branches", DECODERS[".json"], refresh=True
+            f"{self.base_url}/branches", DECODERS[".json"], ttl=BRANCH_TTL
         )
         self._tag_checked = True if skip_branchtest else False
         self._want_commit_cached = None
+        self.archive_mode = archive_mode
+        self._archive_index_cached = None
 
     def __str__(self):
         return f"{self.__class__.__name__} {self.base_url} {self.reftag}"
@@ -134,25 +203,81 @@ class GitlabConnector(RepositoryConnector):
             filepath = quote(pathstr, safe="")
             return f"{self.base_url}/files/{filepath}?ref={ref}"
 
+    def _build_archive_url(self):
+        ref = self.reftag if self.want_commit is None else self.want_commit["short_id"]
+        return f"{self.base_url}/archive.zip?sha={quote(ref, safe='')}"
+
+    @property
+    def _archive_index(self):
+        """
+        Returns the root folder name and the list of file paths
+        of the repository archive, downloading the archive if needed.
+        Returns None if the archive is not available.
+        """
+        if self._archive_index_cached is None:
+            try:
+                loader = HttpRequest(
+                    self._build_archive_url(),
+                    msg_if_not_cached=f"Downloading repository archive of {self}",
+                )
+                loader._retrieve()
+                with ZipFile(loader.cachefile) as zipfile:
+                    members = [n for n in zipfile.namelist() if not n.endswith("/")]
+                root = members[0].split("/")[0]
+                paths = [n[len(root) + 1:] for n in members]
+                self._archive_index_cached = (root, paths)
+            except Exception as e:
+                logger.warning(
+                    f"Could not use repository archive of {self} ({e}), "
+                    "falling back to retrieving individual files."
+                )
+                self.archive_mode = False
+        return self._archive_index_cached
+
     def _decode_response(self, response, filename):
         json_response = json.loads(response.decode())
         content = base64.b64decode(json_response["content"].encode("ascii"))
         return RepositoryConnector._decode_response(self, content, filename)
 
-    def search_files(self, folder="", suffix=None, recursive=False):
+    def get_loader(self, filename, folder="", decode_func=None):
+        if self.archive_mode and self._archive_index is not None:
+            root, _ = self._archive_index
+            pathstr = filename if folder == "" else f"{folder}/{filename}"
+            if decode_func is None:
+                decode_func = _suffix_decoder(filename)
+            return ZipfileRequest(
+                self._build_archive_url(), f"{root}/{pathstr}", decode_func
+            )
+        return RepositoryConnector.get_loader(self, filename, folder, decode_func)
+
+    def _tree_loaders(self, folder="", recursive=False):
+        """ Iterate over the loaders for all pages of a folder listing. """
         page = 1
-        results = []
         while True:
             loader = LazyHttpRequest(
                 self._build_url(folder, recursive=recursive, page=page),
                 DECODERS[".json"],
             )
-            results.extend(loader.data)
+            yield loader
             if len(loader.data) < self._per_page:
                 # no more pages
                 break
             page += 1
+
+    def search_files(self, folder="", suffix=None, recursive=False):
         end = "" if suffix is None else suffix
+        if self.archive_mode and self._archive_index is not None:
+            _, paths = self._archive_index
+            prefix = "" if folder == "" else folder.rstrip("/") + "/"
+            return [
+                p for p in paths
+                if p.startswith(prefix)
+                and p.endswith(end)
+                and (recursive or "/" not in p[len(prefix):])
+            ]
+        results = []
+        for loader in self._tree_loaders(folder, recursive):
+            results.extend(loader.data)
         return [
             e["path"]
             for e in results
@@ -13,28 +13,284 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .cache import CACHE
+from .cache import CACHE, MEMCACHE, PARTIAL_SUFFIX
+from .metrics import METRICS
 from ..commons import logger
 
 import json
 from zipfile import ZipFile
 import requests
-from urllib.parse import quote
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote, urlsplit
 import os
-from nibabel import Nifti1Image
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, Future
+from tqdm import tqdm
+import numpy as np
+from nibabel import Nifti1Image, Nifti1Header
+from nibabel.fileholders import FileHolder
 import gzip
+import zlib
+import lzma
+
+# default timeout in seconds for http requests,
+# either a single value or "connect,read" timeouts
+HTTP_TIMEOUT = [float(t) for t in os.getenv("SIIBRA_HTTP_TIMEOUT", "10,120").split(",")]
+HTTP_TIMEOUT = HTTP_TIMEOUT[0] if len(HTTP_TIMEOUT) == 1 else tuple(HTTP_TIMEOUT)
+# number of connections kept alive per host
+HTTP_POOLSIZE = int(os.getenv("SIIBRA_HTTP_POOLSIZE", 10))
+# size of the chunks in which downloads are written to the cache
+DOWNLOAD_CHUNKSIZE = 1024 ** 2
+# default number of threads used for prefetching the data of lazy loaders
+PREFETCH_WORKERS = int(os.getenv("SIIBRA_PREFETCH_WORKERS", 8))
+# In offline mode, data is only served from the cache and no http requests are made.
+OFFLINE = os.getenv("SIIBRA_OFFLINE", "0").lower() in ["1", "true", "yes", "on"]
+# Optional compression of cached text payloads like json: "zlib", "lzma" or "none"
+CACHE_COMPRESSION = os.getenv("SIIBRA_CACHE_COMPRESSION", "none").lower()
+# content types and url suffixes of payloads which are worth compressing
+COMPRESSIBLE_CONTENT_TYPES = ["text/", "application/json", "application/xml", "application/javascript"]
+COMPRESSIBLE_SUFFIXES = [".json", ".txt", ".csv", ".xml", ".pts"]
+# url suffixes of payloads which are compressed already, or read directly from the cache file
+NONCOMPRESSIBLE_SUFFIXES = [".gz", ".zip", ".bz2", ".xz", ".png", ".jpg", ".jpeg", ".npy", ".nii"]
+# compressed cache files start with one of these markers
+COMPRESSION_MARKERS = {
+    "zlib": b"SIIBRA-ZLIB\n",
+    "lzma": b"SIIBRA-LZMA\n",
+}
+# If enabled, gzipped NIfTI files are decompressed once into the cache and
+# memory-mapped, so that slicing an image only reads the requested part from disk.
+DECOMPRESS_NIFTI = os.getenv("SIIBRA_DECOMPRESS_NIFTI", "0").lower() in ["1", "true", "yes", "on"]
+# number of retries for failed http requests, with exponential backoff starting at HTTP_BACKOFF seconds
+HTTP_RETRIES = int(os.getenv("SIIBRA_HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.getenv("SIIBRA_HTTP_BACKOFF", 0.5))
+# Manifest which records all retrieved content, if recording is enabled
+# (see siibra.retrieval.manifest.start_recording)
+RECORDER = None
+# size of a NIfTI-1 header, which is all that needs to be retrieved for reading image metadata
+NIFTI_HEADER_NBYTES = 348
+# optional per-host overrides of the connection pool size
+HTTP_HOST_POOLSIZES = {
+    "https://jugit.fz-juelich.de": 20,
+    "https://gitlab.ebrains.eu": 20,
+}
+
+
+# Decoders are module-level functions instead of lambdas,
+# so that loaders using them can be pickled.
+def decode_nifti_gz(b):
+    return Nifti1Image.from_bytes(gzip.decompress(b))
+
+
+def decode_nifti(b):
+    return Nifti1Image.from_bytes(b)
+
+
+def decode_nifti_header(b):
+    return Nifti1Header(b[:NIFTI_HEADER_NBYTES])
+
+
+def decode_json(b):
+    return json.loads(b.decode())
+
+
+def decode_text(b):
+    return b.decode()
+
+
+def decode_identity(b):
+    return b
+
 
 DECODERS = {
-    ".nii.gz": lambda b: Nifti1Image.from_bytes(gzip.decompress(b)),
-    ".nii": lambda b: Nifti1Image.from_bytes(b),
-    ".json": lambda b: json.loads(b.decode()),
-    ".txt": lambda b: b.decode(),
+    ".nii.gz": decode_nifti_gz,
+    ".nii": decode_nifti,
+    ".json": decode_json,
+    ".txt": decode_text,
+}
+
+
+def decompress_nifti_gz(filename):
+    """
+    Returns the name of a decompressed copy of the given gzipped NIfTI cache file,
+    creating it in the cache if needed. The copy is rebuilt if the
+    gzipped file was written after it, e.g. when it was refreshed.
+    """
+    target = CACHE.build_filename(os.path.basename(filename), suffix="nii")
+
+    def uptodate():
+        return CACHE.available(target) and os.path.getmtime(target) >= os.path.getmtime(filename)
+
+    if uptodate():
+        CACHE.hit(target)
+        return target
+    with CACHE.lock(target):
+        if not uptodate():
+            with gzip.open(filename, "rb") as src, CACHE.atomic_write(target) as dst:
+                shutil.copyfileobj(src, dst, DOWNLOAD_CHUNKSIZE)
+            CACHE.add(target)
+    return target
+
+
+def load_nifti_gz(filename):
+    if DECOMPRESS_NIFTI:
+        return load_nifti(decompress_nifti_gz(filename))
+    # The image data is decompressed while reading the file, without reading the
+    # compressed file into memory first. It is read right away, so that the file is closed.
+    with gzip.open(filename, "rb") as f:
+        fileholder = FileHolder(fileobj=f)
+        img = Nifti1Image.from_file_map({"header": fileholder, "image": fileholder})
+        return Nifti1Image(np.asanyarray(img.dataobj), img.affine, img.header)
+
+
+def load_nifti(filename):
+    # image data of uncompressed files is memory-mapped by nibabel
+    fileholder = FileHolder(filename=filename)
+    return Nifti1Image.from_file_map({"header": fileholder, "image": fileholder})
+
+
+# Decoders which are able to read directly from a file,
+# used instead of the corresponding bytes decoder when loading from the cache.
+FILE_DECODERS = {
+    decode_nifti_gz: load_nifti_gz,
+    decode_nifti: load_nifti,
 }
 
 
+class _TimeoutAdapter(HTTPAdapter):
+    """ HTTPAdapter which applies a default timeout to all requests. """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+_SESSION = None
+_SESSION_PID = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """
+    Return the http session shared by all siibra requests of this process.
+    The session keeps connections alive in a pool per host, so that
+    subsequent requests to the same server avoid the TCP and TLS handshakes.
+    A new session is created after a process fork, since pooled
+    connections cannot be shared between processes.
+    """
+    global _SESSION, _SESSION_PID
+    with _SESSION_LOCK:
+        if _SESSION is None or _SESSION_PID != os.getpid():
+            session = requests.Session()
+            adapter = _TimeoutAdapter(
+                pool_connections=HTTP_POOLSIZE, pool_maxsize=HTTP_POOLSIZE
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            for host, poolsize in HTTP_HOST_POOLSIZES.items():
+                session.mount(
+                    host, _TimeoutAdapter(pool_connections=1, pool_maxsize=poolsize)
+                )
+            _SESSION = session
+            _SESSION_PID = os.getpid()
+        return _SESSION
+
+
+def set_host_poolsize(url, poolsize):
+    """
+    Define the number of pooled connections to keep for the host of the given url.
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    HTTP_HOST_POOLSIZES[host] = poolsize
+    get_session().mount(
+        host, _TimeoutAdapter(pool_connections=1, pool_maxsize=poolsize)
+    )
+
+
+def _compressor(codec):
+    if codec == "zlib":
+        return zlib.compressobj()
+    if codec == "lzma":
+        return lzma.LZMACompressor()
+    raise ValueError(
+        f"Unknown cache compression '{codec}', use one of {', '.join(COMPRESSION_MARKERS)}."
+    )
+
+
+def _decompress(codec, data):
+    return zlib.decompress(data) if codec == "zlib" else lzma.decompress(data)
+
+
+def read_cachefile(filename):
+    """
+    Read the content of a cache file written by HttpRequest,
+    decompressing it if it was stored compressed.
+    """
+    with open(filename, "rb") as f:
+        head = f.read(max(len(m) for m in COMPRESSION_MARKERS.values()))
+        for codec, marker in COMPRESSION_MARKERS.items():
+            if head.startswith(marker):
+                return _decompress(codec, head[len(marker):] + f.read())
+        return head + f.read()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key within the process:
+    the first caller runs the function, while callers arriving before
+    it finished wait for it and share its result (or exception).
+    Results are not kept afterwards.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def run(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = func()
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+# coalesces concurrent retrieval and decoding of the same content
+SINGLEFLIGHT = SingleFlight()
+
+
+class _ServerError(RuntimeError):
+    # Raised for http server errors, which are retried.
+    pass
+
+
 class HttpRequest:
+
+    # Wether to compress the cached payload. If None,
+    # this is decided from content type and url (see SIIBRA_CACHE_COMPRESSION).
+    compress = None
+
     def __init__(
-        self, url, func=None, status_code_messages={}, msg_if_not_cached=None, refresh=False, **kwargs
+        self, url, func=None, status_code_messages={}, msg_if_not_cached=None, refresh=False,
+        ttl=None, **kwargs
     ):
         """
         Initialize a cached http data loader.
@@ -56,7 +312,12 @@ class HttpRequest:
             Optional dictionary of message strings to output in case of error,
             where keys are http status code.
         refresh : bool, default: False
-            If True, a possibly cached content will be ignored and refreshed
+            If True, a possibly cached content will be revalidated with the server
+            and refreshed if it changed
+        ttl : float, default: None
+            Number of seconds for which cached content is considered up to date
+            after it was retrieved or last revalidated. If None, cached content
+            never expires.
         """
         assert url is not None
         self.url = url
@@ -66,53 +327,214 @@ class HttpRequest:
         self.cachefile = CACHE.build_filename(self.url + json.dumps(kwargs))
         self.msg_if_not_cached = msg_if_not_cached
         self.refresh = refresh
+        self.ttl = ttl
 
     @property
     def cached(self):
-        return os.path.isfile(self.cachefile)
+        return CACHE.exists(self.cachefile)
+
+    @property
+    def fresh(self):
+        """
+        Wether the cached content can be used without revalidating it with the server.
+        """
+        if self.refresh:
+            return False
+        if self.ttl is None:
+            return True
+        validator = CACHE.index.validator(self.cachefile)
+        checked = os.path.getmtime(self.cachefile) if validator is None else validator[2]
+        return time.time() - checked < self.ttl
 
     def _retrieve(self):
-        # Loads the data from http if required.
-        # If the data is already cached, None is returned,
-        # otherwise data (as it is already in memory anyway).
-        # The caller should load the cachefile only
-        # if None is returned.
-        if self.cached and not self.refresh:
+        # Loads the data from http into the cachefile if required,
+        # and records the request if a manifest is being recorded.
+        self._retrieve_to_cache()
+        if RECORDER is not None:
+            # only content which could be retrieved is recorded
+            RECORDER.record(self)
+
+    def _retrieve_to_cache(self):
+        # The response is streamed to a temporary file in chunks,
+        # which is then moved into place, so the payload
+        # is never held in memory as a whole.
+        CACHE.available(self.cachefile)
+        if self.cached and (OFFLINE or self.fresh):
             # in cache. Just load the file
             logger.debug(
                 f"Already in cache at {os.path.basename(self.cachefile)}: {self.url}"
             )
+            CACHE.hit(self.cachefile)
+            METRICS.hit("disk")
             return
-        else:
-            # not yet in cache, perform http request.
+        if OFFLINE:
+            raise RuntimeError(
+                f"siibra runs in offline mode (SIIBRA_OFFLINE), but {self.url} "
+                f"is not available in the cache at {CACHE.folder}."
+            )
+        with CACHE.lock(self.cachefile):
+            if self.cached and self.fresh:
+                # another process retrieved the file while we were waiting for the lock
+                CACHE.hit(self.cachefile)
+                METRICS.hit("disk")
+                return
+            # not yet in cache or outdated, perform http request.
+            METRICS.miss("disk")
             logger.debug(f"Loading {self.url} to {os.path.basename(self.cachefile)}")
             if self.msg_if_not_cached is not None:
                 logger.info(self.msg_if_not_cached)
-            r = requests.get(self.url, **self.kwargs)
-            if r.ok:
-                with open(self.cachefile, "wb") as f:
-                    f.write(r.content)
-                self.refresh = False
-                return r.content
-            elif r.status_code in self.status_code_messages:
-                raise RuntimeError(self.status_code_messages[r.status_code])
-            else:
+            for attempt in range(HTTP_RETRIES + 1):
+                try:
+                    self._download()
+                    break
+                except (
+                    requests.ConnectionError,
+                    requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    _ServerError
+                ) as e:
+                    if attempt == HTTP_RETRIES:
+                        raise
+                    delay = HTTP_BACKOFF * 2 ** attempt
+                    logger.warning(
+                        f"Retrieving {self.url} failed ({type(e).__name__}), retrying in {delay:.1f} seconds."
+                    )
+                    time.sleep(delay)
+            self.refresh = False
+
+    def _download(self):
+        # Streams the response into the cache. Uncompressed payloads are written
+        # to a partial file next to the cache file, together with the validator
+        # (ETag or Last-Modified) of the response. If the transfer breaks, it is
+        # continued from the end of the partial file with a range request,
+        # as long as the validator of the remote file did not change.
+        # The partial file is not shared with other processes, since
+        # downloads are performed while holding the lock of the cache file.
+        partfile = f"{self.cachefile}{PARTIAL_SUFFIX}"
+        validatorfile = f"{self.cachefile}.validator{PARTIAL_SUFFIX}"
+        kwargs = dict(self.kwargs)
+        headers = dict(kwargs.pop("headers", {}))
+        offset = 0
+        if "Range" not in headers and os.path.isfile(partfile) and os.path.isfile(validatorfile):
+            with open(validatorfile, "r") as f:
+                validator = f.read()
+            offset = os.path.getsize(partfile)
+            if offset > 0 and len(validator) > 0:
+                headers.update({"Range": f"bytes={offset}-", "If-Range": validator})
+                logger.info(f"Resuming download of {self.url} at {offset} bytes.")
+        validator = CACHE.index.validator(self.cachefile) if self.cached else None
+        if validator is not None and "Range" not in headers:
+            # ask the server to send the content only if it changed
+            etag, modified, _ = validator
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if modified is not None:
+                headers["If-Modified-Since"] = modified
+
+        start = time.time()
+        nbytes = 0
+        r = get_session().get(self.url, stream=True, headers=headers, **kwargs)
+        try:
+            if r.status_code == 304 and validator is not None:
+                logger.debug(f"Cached content of {self.url} is up to date.")
+                CACHE.index.set_validator(self.cachefile, *validator[:2])
+                CACHE.hit(self.cachefile)
+                METRICS.download(self.url, 0, time.time() - start)
+                return
+            if offset > 0 and (r.status_code == 416 or (
+                r.status_code == 206
+                and not r.headers.get("Content-Range", "").startswith(f"bytes {offset}-")
+            )):
+                # the partial file does not fit the remote file, start over
+                logger.info(f"Could not resume download of {self.url}, starting over.")
+                os.remove(partfile)
+                os.remove(validatorfile)
+                r.close()
+                return self._download()
+            if r.status_code >= 500:
+                raise _ServerError(
+                    f"Could not retrieve data.\nhttp status code: {r.status_code}\nURL: {self.url}"
+                )
+            if not r.ok:
+                if r.status_code in self.status_code_messages:
+                    raise RuntimeError(self.status_code_messages[r.status_code])
                 print(self.kwargs)
                 raise RuntimeError(
                     f"Could not retrieve data.\nhttp status code: {r.status_code}\nURL: {self.url}"
                 )
+            self._check_response(r)
+
+            codec = self._compression_codec(r)
+            if codec is not None:
+                # compressed payloads can not be resumed
+                compressor = _compressor(codec)
+                with CACHE.atomic_write(self.cachefile) as f:
+                    f.write(COMPRESSION_MARKERS[codec])
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNKSIZE):
+                        nbytes += len(chunk)
+                        f.write(compressor.compress(chunk))
+                    f.write(compressor.flush())
+            else:
+                # a partial response to a resumed request continues the partial file
+                resumed = offset > 0 and r.status_code == 206
+                if not resumed:
+                    validator = r.headers.get("ETag", r.headers.get("Last-Modified", ""))
+                    if "Range" in self.kwargs.get("headers", {}):
+                        # partial content itself is not resumed
+                        validator = ""
+                    with open(validatorfile, "w") as f:
+                        f.write(validator)
+                with open(partfile, "ab" if resumed else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNKSIZE):
+                        nbytes += len(chunk)
+                        f.write(chunk)
+                os.replace(partfile, self.cachefile)
+                os.remove(validatorfile)
+            CACHE.add(self.cachefile, self.url)
+            METRICS.download(self.url, nbytes, time.time() - start)
+            if "ETag" in r.headers or "Last-Modified" in r.headers:
+                CACHE.index.set_validator(
+                    self.cachefile, r.headers.get("ETag"), r.headers.get("Last-Modified")
+                )
+        finally:
+            r.close()
+
+    def _check_response(self, response):
+        # Hook for validating a successful response before it is cached.
+        pass
+
+    def _compression_codec(self, response):
+        # Decide which compression to apply to the cached payload, if any.
+        if self.compress is False or CACHE_COMPRESSION == "none":
+            return None
+        if self.compress:
+            return CACHE_COMPRESSION
+        path = urlsplit(self.url).path.lower()
+        if any(path.endswith(sfx) for sfx in NONCOMPRESSIBLE_SUFFIXES):
+            return None
+        content_type = response.headers.get("Content-Type", "").lower()
+        if any(content_type.startswith(t) for t in COMPRESSIBLE_CONTENT_TYPES) \
+                or any(path.endswith(sfx) for sfx in COMPRESSIBLE_SUFFIXES):
+            return CACHE_COMPRESSION
+        return None
 
     def get(self):
-        data = self._retrieve()
-        if data is None:
-            with open(self.cachefile, "rb") as f:
-                data = f.read()
-        return data if self.func is None else self.func(data)
+        self._retrieve()
+        start = time.time()
+        if self.func in FILE_DECODERS:
+            # decode directly from the cached file
+            result = FILE_DECODERS[self.func](self.cachefile)
+        else:
+            data = read_cachefile(self.cachefile)
+            result = data if self.func is None else self.func(data)
+        METRICS.decode(time.time() - start)
+        return result
 
 
 class LazyHttpRequest(HttpRequest):
     def __init__(
-        self, url, func=None, status_code_messages={}, msg_if_not_cached=None, refresh=False, **kwargs
+        self, url, func=None, status_code_messages={}, msg_if_not_cached=None, refresh=False,
+        ttl=None, **kwargs
     ):
         """
         Initialize a lazy and cached http data loader.
@@ -136,11 +558,19 @@ class LazyHttpRequest(HttpRequest):
             Optional dictionary of message strings to output in case of error,
             where keys are http status code.
         refresh : bool, default: False
-            If True, a possibly cached content will be ignored and refreshed
+            If True, a possibly cached content will be revalidated with the server
+            and refreshed if it changed
+        ttl : float, default: None
+            Number of seconds for which cached content is considered up to date
+            after it was retrieved or last revalidated. If None, cached content
+            never expires.
         """
         HttpRequest.__init__(
-            self, url, func, status_code_messages, msg_if_not_cached, refresh, **kwargs
+            self, url, func, status_code_messages, msg_if_not_cached, refresh, ttl, **kwargs
         )
+        # Loaders which revalidate cached content do so on their first access,
+        # instead of using decoded data held in memory for other loaders.
+        self._revalidate = refresh or ttl is not None
         self._data_cached = None
         suitable_decoders = [dec for sfx, dec in DECODERS.items() if url.endswith(sfx)]
         if (func is None) and (len(suitable_decoders) > 0):
@@ -151,15 +581,192 @@ class LazyHttpRequest(HttpRequest):
 
     @property
     def data(self):
-        if self._data_cached is None:
-            self._data_cached = self.get()
-        return self._data_cached
+        # Decoded data is kept in a size-bounded memory cache, shared by loaders
+        # of the same content. If it was dropped from there, it is decoded again
+        # from the disk cache.
+        # Objects exceeding the memory cache are only kept by the loader itself.
+        key = self._flightkey
+        if self._revalidate:
+            data = None
+        elif self._data_cached is not None:
+            data = self._data_cached
+        else:
+            data = MEMCACHE.get(key)
+        if data is None:
+            METRICS.miss("memory")
+            # concurrent requests for the same content are retrieved and decoded only once
+            data = SINGLEFLIGHT.run(key, self.get)
+            self._data_cached = None if MEMCACHE.put(key, data) else data
+            self._revalidate = False
+        else:
+            METRICS.hit("memory")
+        return data
+
+    @property
+    def _flightkey(self):
+        # identifies the decoded content, shared by loaders of the same url and decoder
+        return (self.cachefile, self.func)
+
+
+class NiftiHeaderRequest(LazyHttpRequest):
+
+    # the header is tiny, and binary
+    compress = False
+
+    def __init__(self, url):
+        """
+        Initialize a lazy loader for the header of a remote NIfTI file,
+        which provides image shape, data type and affine without
+        downloading the image data. For uncompressed files, only the
+        header bytes are requested using an http range request. For
+        gzipped files, the response is streamed and closed as soon as
+        the header could be decompressed. The header is cached separately
+        from the image.
+
+        Parameters
+        ----------
+        url : string
+            URL of a .nii or .nii.gz file
+        """
+        LazyHttpRequest.__init__(self, url, func=decode_nifti_header)
+        self.cachefile = CACHE.build_filename(f"{url}#header")
+
+    def _read_cached_image_header(self):
+        # If the whole image is in the cache already, the header is read from there.
+        imagefile = HttpRequest(self.url).cachefile
+        if not CACHE.available(imagefile):
+            return None
+        opener = gzip.open if urlsplit(self.url).path.endswith(".gz") else open
+        with opener(imagefile, "rb") as f:
+            block = f.read(NIFTI_HEADER_NBYTES)
+        return block if len(block) == NIFTI_HEADER_NBYTES else None
+
+    def _retrieve_to_cache(self):
+        CACHE.available(self.cachefile)
+        if self.cached:
+            CACHE.hit(self.cachefile)
+            METRICS.hit("disk")
+            return
+        block = self._read_cached_image_header()
+        if block is not None:
+            with CACHE.atomic_write(self.cachefile) as f:
+                f.write(block)
+            CACHE.add(self.cachefile, self.url)
+            METRICS.hit("disk")
+            return
+        if OFFLINE:
+            raise RuntimeError(
+                f"siibra runs in offline mode (SIIBRA_OFFLINE), but the header of {self.url} "
+                f"is not available in the cache at {CACHE.folder}."
+            )
+        with CACHE.lock(self.cachefile):
+            if self.cached:
+                CACHE.hit(self.cachefile)
+                METRICS.hit("disk")
+                return
+            METRICS.miss("disk")
+            logger.debug(f"Loading NIfTI header of {self.url}")
+            gzipped = urlsplit(self.url).path.endswith(".gz")
+            # Servers which do not support range requests send the whole file,
+            # which is fine since the response is closed after reading the header.
+            headers = {} if gzipped else {"Range": f"bytes=0-{NIFTI_HEADER_NBYTES - 1}"}
+            start = time.time()
+            nbytes = 0
+            r = get_session().get(self.url, stream=True, headers=headers)
+            try:
+                if not r.ok:
+                    raise RuntimeError(
+                        f"Could not retrieve NIfTI header.\nhttp status code: {r.status_code}\nURL: {self.url}"
+                    )
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+                block = b""
+                for chunk in r.iter_content(chunk_size=8192):
+                    nbytes += len(chunk)
+                    if decompressor is None:
+                        block += chunk
+                    else:
+                        block += decompressor.decompress(
+                            decompressor.unconsumed_tail + chunk,
+                            NIFTI_HEADER_NBYTES - len(block)
+                        )
+                    if len(block) >= NIFTI_HEADER_NBYTES:
+                        break
+                if len(block) < NIFTI_HEADER_NBYTES:
+                    raise RuntimeError(f"Could not read NIfTI header from {self.url}")
+                with CACHE.atomic_write(self.cachefile) as f:
+                    f.write(block[:NIFTI_HEADER_NBYTES])
+                CACHE.add(self.cachefile, self.url)
+                METRICS.download(self.url, nbytes, time.time() - start)
+            finally:
+                r.close()
+
+
+class HttpRangeRequest(LazyHttpRequest):
+
+    # ranges are read from the cache file as they are
+    compress = False
+
+    def __init__(self, url, start, stop):
+        """
+        Initialize a lazy loader for the bytes start..stop-1 of a remote file,
+        using an http range request. The range is cached as a file of its own.
+        If the server does not support range requests, retrieval fails with a
+        RuntimeError instead of caching the whole file.
+
+        Parameters
+        ----------
+        url : string
+            URL of the file
+        start : int
+            Offset of the first byte
+        stop : int
+            Offset after the last byte
+        """
+        LazyHttpRequest.__init__(
+            self, url, func=decode_identity, headers={"Range": f"bytes={start}-{stop - 1}"}
+        )
+        self.start = start
+        self.stop = stop
+
+    def _check_response(self, response):
+        if response.status_code != 206:
+            raise RuntimeError(f"Server of {self.url} does not support range requests.")
 
 
 class ZipfileRequest(LazyHttpRequest):
-    def __init__(self, url, filename, func=None):
+
+    # the archive is read directly from the cache file
+    compress = False
+
+    # Wether to keep zip archives in the cache after a member was extracted.
+    # If False, the archive needs to be downloaded again for extracting other members.
+    keep_archive = os.getenv("SIIBRA_KEEP_ZIP_ARCHIVES", "1") != "0"
+
+    def __init__(self, url, filename, func=None, keep_archive=None):
+        """
+        Initialize a lazy loader for a file inside a zip archive.
+        The requested member is extracted only once into its own cache file,
+        from which it is decoded on subsequent accesses.
+
+        Parameters
+        ----------
+        url : string
+            URL of the zip archive
+        filename : string
+            Trailing part of the member's path in the archive
+        func : function pointer
+            Optional function for decoding the member's content
+        keep_archive : bool, default: None
+            Wether to keep the archive in the cache after extraction.
+            If None, SIIBRA_KEEP_ZIP_ARCHIVES is respected.
+        """
         LazyHttpRequest.__init__(self, url)
         self.filename = filename
+        if keep_archive is not None:
+            self.keep_archive = keep_archive
+        self.member_cachefile = CACHE.build_filename(
+            f"{self.url}{json.dumps(self.kwargs)}#{filename}"
+        )
         if func is None:
             suitable_decoders = [
                 dec for sfx, dec in DECODERS.items() if filename.endswith(sfx)
@@ -168,28 +775,116 @@ class ZipfileRequest(LazyHttpRequest):
                 assert len(suitable_decoders) == 1
                 self._decoder = suitable_decoders[0]
             else:
-                self._decoder = lambda b: b
+                self._decoder = decode_identity
         else:
             self._decoder = func
 
     @property
-    def data(self):
-        if self._data_cached is None:
+    def cached(self):
+        return CACHE.exists(self.member_cachefile) or super().cached
+
+    @property
+    def _flightkey(self):
+        return (self.member_cachefile, self._decoder)
+
+    def _extract(self):
+        # Extract the requested member from the archive into its own cache file.
+        with CACHE.lock(self.member_cachefile):
+            if os.path.isfile(self.member_cachefile):
+                # extracted by another process while we were waiting
+                return
             self._retrieve()
-            zipfile = ZipFile(self.cachefile)
-            filenames = zipfile.namelist()
-            matches = [fn for fn in filenames if fn.endswith(self.filename)]
-            if len(matches) == 0:
-                raise RuntimeError(
-                    f"Requested filename {self.filename} not found in archive at {self.url}"
-                )
-            if len(matches) > 1:
-                raise RuntimeError(
-                    f'Requested filename {self.filename} was not unique in archive at {self.url}. Candidates were: {", ".join(matches)}'
-                )
-            with zipfile.open(matches[0]) as f:
-                self._data_cached = self._decoder(f.read())
-        return self._data_cached
+            with ZipFile(self.cachefile) as zipfile:
+                filenames = zipfile.namelist()
+                matches = [fn for fn in filenames if fn.endswith(self.filename)]
+                if len(matches) == 0:
+                    raise RuntimeError(
+                        f"Requested filename {self.filename} not found in archive at {self.url}"
+                    )
+                if len(matches) > 1:
+                    raise RuntimeError(
+                        f'Requested filename {self.filename} was not unique in archive at {self.url}. Candidates were: {", ".join(matches)}'
+                    )
+                logger.debug(f"Extracting {matches[0]} from {self.url}")
+                with zipfile.open(matches[0]) as src, \
+                        CACHE.atomic_write(self.member_cachefile) as dst:
+                    shutil.copyfileobj(src, dst, DOWNLOAD_CHUNKSIZE)
+            CACHE.add(self.member_cachefile, self.url)
+            if not self.keep_archive:
+                logger.debug(f"Removing archive {self.url} from cache after extraction")
+                os.remove(self.cachefile)
+                CACHE.index.remove(self.cachefile)
+
+    def get(self):
+        if CACHE.available(self.member_cachefile):
+            CACHE.hit(self.member_cachefile)
+            METRICS.hit("disk")
+        else:
+            self._extract()
+        if RECORDER is not None:
+            # also recorded if the member was already extracted, and the archive not retrieved
+            RECORDER.record(self)
+        start = time.time()
+        if self._decoder in FILE_DECODERS:
+            # decode directly from the extracted file
+            result = FILE_DECODERS[self._decoder](self.member_cachefile)
+        else:
+            with open(self.member_cachefile, "rb") as f:
+                result = self._decoder(f.read())
+        METRICS.decode(time.time() - start)
+        return result
+
+
+def prefetch(loaders, max_workers=None, desc=None, decode=True, raise_errors=True):
+    """
+    Retrieve and decode the data of several lazy loaders concurrently,
+    using a bounded pool of threads. Afterwards, accessing the 'data'
+    property of the loaders does not require any further downloads.
+
+    Parameters
+    ----------
+    loaders : list of LazyHttpRequest
+        The loaders to fill.
+    max_workers : int, default: None
+        Maximum number of concurrent downloads. If None, SIIBRA_PREFETCH_WORKERS is used.
+    desc : str, default: None
+        If given, a progress bar with this description is shown.
+    decode : bool, default: True
+        If False, the content is only retrieved into the disk cache, but not decoded.
+    raise_errors : bool, default: True
+        If False, failed loaders are logged and skipped instead of raising
+        the first error.
+
+    Returns
+    -------
+    List of (loader, exception) of the loaders which failed.
+    """
+    loaders = list(loaders)
+    failed = []
+    if len(loaders) == 0:
+        return failed
+    workers = min(len(loaders), max_workers or PREFETCH_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # downloads of the worker threads are attributed to the trigger of the caller
+        trigger = METRICS.current_trigger
+
+        def load(loader):
+            with METRICS.trigger(trigger):
+                return loader.data if decode else loader._retrieve()
+
+        futures = {executor.submit(load, loader): loader for loader in loaders}
+        completed = as_completed(futures)
+        if desc is not None:
+            completed = tqdm(completed, total=len(futures), desc=desc)
+        for future in completed:
+            error = future.exception()
+            if error is None:
+                continue
+            if raise_errors:
+                raise error
+            logger.warning(f"Could not retrieve {futures[future].url}: {error}")
+            failed.append((futures[future], error))
+    return failed
 
 
 class EbrainsRequest(LazyHttpRequest):
@@ -237,6 +932,15 @@ class EbrainsRequest(LazyHttpRequest):
             msg_if_not_cached=f"Executing EBRAINS KG query {query_id}{inst_tail}",
         )
 
+    @classmethod
+    def from_url(cls, url, params={}):
+        """ Create a request for a given query url, as recorded in a manifest. """
+        request = cls.__new__(cls)
+        request.schema = None
+        request.params = params
+        LazyHttpRequest.__init__(request, url, DECODERS[".json"], cls.SC_MESSAGES)
+        return request
+
     @classmethod
     def set_token(cls, token):
         logger.info(f"Setting EBRAINS Knowledge Graph authentication token: {token}")
@@ -262,7 +966,7 @@ class EbrainsRequest(LazyHttpRequest):
         }
         if None not in keycloak.values():
             logger.info("Getting an EBRAINS token via keycloak client configuration...")
-            result = requests.post(
+            result = get_session().post(
                 self.__class__.keycloak_endpoint,
                 data = (
                     f"grant_type=client_credentials&client_id={keycloak['client_id']}"
@@ -292,11 +996,13 @@ class EbrainsRequest(LazyHttpRequest):
         
         return self.__class__._KG_API_TOKEN
 
-    def get(self):
+    def _retrieve(self):
         """Evaluate KG Token is evaluated only on executrion of the request."""
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.kg_token}",
-        }
-        self.kwargs = {"headers": headers, "params": self.params}
-        return super().get()
+        if not OFFLINE:
+            # in offline mode, no token is needed since the query result can only come from the cache
+            headers = {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.kg_token}",
+            }
+            self.kwargs = {"headers": headers, "params": self.params}
+        return super()._retrieve()
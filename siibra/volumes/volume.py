@@ -17,19 +17,27 @@ from .. import logger
 from ..commons import MapType
 from ..core.datasets import Dataset
 from ..core.space import Space, BoundingBox
-from ..retrieval import LazyHttpRequest, HttpRequest, ZipfileRequest, CACHE
+from ..retrieval import LazyHttpRequest, ZipfileRequest, CACHE, requests
+from ..retrieval.metrics import METRICS
 
 from ctypes import ArgumentError
 import numpy as np
 import nibabel
+from nibabel.volumeutils import apply_read_scaling
 from cloudvolume.exceptions import OutOfBoundsError
-from cloudvolume import CloudVolume
+from cloudvolume import CloudVolume, Bbox
 import os
 import json
+import time
+from itertools import product
 from abc import ABC, abstractmethod
 
 gbyte_feasible = 0.1
 
+# offset of the image data in NIfTI files written by siibra:
+# the header (348 bytes) followed by an empty extension flag (4 bytes)
+NIFTI_DATA_OFFSET = 352
+
 
 class VolumeSrc(Dataset, type_id="fzj/tmp/volume_type/v0.0.1"):
 
@@ -211,13 +219,22 @@ class LocalNiftiVolume(ImageProvider):
 class RemoteNiftiVolume(ImageProvider, VolumeSrc, volume_type="nii"):
 
     _image_cached = None
+    _header_loader = None
+    _range_loaders = None
+    # Wether to read parts of uncompressed images using http range requests,
+    # and the size of the cached blocks in which byte ranges are retrieved.
+    _ranged_reads = True
+    _range_blocksize = 1024 ** 2
 
     def __init__(
         self, identifier, name, url, space, detail=None, zipped_file=None, **kwargs
     ):
         VolumeSrc.__init__(self, identifier, name, url, space, detail=detail)
+        self._header_loader = None
         if zipped_file is None:
             self._image_loader = LazyHttpRequest(url)
+            if url.endswith(".nii") or url.endswith(".nii.gz"):
+                self._header_loader = requests.NiftiHeaderRequest(url)
         else:
             self._image_loader = ZipfileRequest(url, zipped_file)
 
@@ -225,6 +242,16 @@ class RemoteNiftiVolume(ImageProvider, VolumeSrc, volume_type="nii"):
     def image(self):
         return self._image_loader.data
 
+    @property
+    def header(self):
+        """
+        The NIfTI header of the image. Only the header is retrieved,
+        or read from the cached image, without decoding the whole image.
+        """
+        if self._header_loader is None:
+            return self.image.header
+        return self._header_loader.data
+
     def fetch(self, resolution_mm=None, voi=None, mapindex=None, clip=False):
         """
         Loads and returns a Nifti1Image object representing the volume source.
@@ -243,41 +270,128 @@ class RemoteNiftiVolume(ImageProvider, VolumeSrc, volume_type="nii"):
         if clip and voi:
             raise ArgumentError("voi and clip cannot only be requested independently")
         shape = self.get_shape()
-        img = None
         if resolution_mm is not None:
             raise NotImplementedError(
                 f"NiftiVolume does not support to specify image resolutions (but {resolution_mm} was given)"
             )
 
-        if mapindex is None:
-            img = self.image
-        elif len(shape) != 4 or mapindex >= shape[3]:
+        if mapindex is not None and (len(shape) != 4 or mapindex >= shape[3]):
             raise IndexError(
                 f"Mapindex of {mapindex} provided for fetching from NiftiVolume, but its shape is {shape}."
             )
-        else:
-            img = nibabel.Nifti1Image(
-                dataobj=self.image.dataobj[:, :, :, mapindex], affine=self.image.affine
-            )
-        assert img is not None
+        affine = self.header.get_best_affine()
 
+        img = None
         bb_vox = None
         if voi is not None:
-            bb_vox = voi.transform_bbox(np.linalg.inv(img.affine))
+            bb_vox = voi.transform_bbox(np.linalg.inv(affine))
         elif clip:
             # determine bounding box by cropping the nonzero values
+            if mapindex is None:
+                img = self.image
+            else:
+                img = nibabel.Nifti1Image(
+                    dataobj=self._read_data((slice(None),) * 3, mapindex), affine=affine
+                )
             bb_vox = BoundingBox.from_image(img)
+        elif mapindex is None:
+            return self.image
 
+        # Only the requested part is read: slicing the data proxy of a memory-mapped
+        # image reads it from disk, ranged reads retrieve it from the server.
+        slices = (slice(None),) * 3
+        shift = np.identity(4)
         if bb_vox is not None:
             (x0, y0, z0), (x1, y1, z1) = bb_vox.minpoint, bb_vox.maxpoint
-            shift = np.identity(4)
             shift[:3, -1] = bb_vox.minpoint
-            img = nibabel.Nifti1Image(
-                dataobj=img.dataobj[x0:x1, y0:y1, z0:z1],
-                affine=np.dot(img.affine, shift),
+            slices = (slice(x0, x1), slice(y0, y1), slice(z0, z1))
+        if img is None:
+            data = self._read_data(slices, mapindex)
+        else:
+            data = img.dataobj[slices]
+        return nibabel.Nifti1Image(dataobj=data, affine=np.dot(affine, shift))
+
+    def _read_data(self, slices, mapindex=None):
+        """
+        Read the image data for the given voxel slices and optional map index.
+        Of uncompressed remote files which are not cached yet, only the
+        needed byte ranges are retrieved if the server supports range requests.
+        """
+        if all([
+            self._ranged_reads,
+            self._header_loader is not None,
+            self.url.endswith(".nii"),
+            not self._image_loader.cached
+        ]):
+            try:
+                return self._read_ranges(slices, mapindex)
+            except RuntimeError as e:
+                logger.info(f"Loading the whole image instead of byte ranges: {e}")
+                self._ranged_reads = False
+        index = slices if mapindex is None else slices + (mapindex,)
+        return self.image.dataobj[index]
+
+    def _range_loader(self, block):
+        if self._range_loaders is None:
+            self._range_loaders = {}
+        if block not in self._range_loaders:
+            self._range_loaders[block] = requests.HttpRangeRequest(
+                self.url, block * self._range_blocksize, (block + 1) * self._range_blocksize
             )
+        return self._range_loaders[block]
+
+    def _read_ranges(self, slices, mapindex=None):
+        # Voxels are stored in Fortran order, so the rows y0..y1 of each
+        # slice z form a contiguous byte span, which includes the voxels
+        # outside of x0..x1 except for the first and last row. The spans
+        # are retrieved in blocks of fixed size, which are cached and can
+        # be reused by other requests.
+        header = self.header
+        shape = header.get_data_shape()
+        if len(shape) not in [3, 4]:
+            raise RuntimeError(f"Ranged reads are not supported for images of shape {shape}")
+        dtype = header.get_data_dtype()
+        offset = int(header.get_data_offset())
+        nx, ny, nz = shape[:3]
+        (x0, x1, _), (y0, y1, _), (z0, z1, _) = [
+            s.indices(n) for s, n in zip(slices, shape[:3])
+        ]
+        width, height, depth = max(x1 - x0, 0), max(y1 - y0, 0), max(z1 - z0, 0)
+        if mapindex is not None:
+            frames = [mapindex]
+        else:
+            frames = range(shape[3]) if len(shape) == 4 else [0]
 
-        return img
+        spans = [
+            (
+                offset + dtype.itemsize * (x0 + nx * (y0 + ny * (z + nz * t))),
+                offset + dtype.itemsize * (x1 + nx * (y1 - 1 + ny * (z + nz * t)))
+            )
+            for t in frames for z in range(z0, z0 + depth)
+        ] if width * height > 0 else []
+
+        bs = self._range_blocksize
+        blocks = sorted({
+            b for start, stop in spans for b in range(start // bs, (stop - 1) // bs + 1)
+        })
+        loaders = [self._range_loader(b) for b in blocks]
+        requests.prefetch(loaders)
+        blockdata = {b: loader.data for b, loader in zip(blocks, loaders)}
+
+        result = np.empty((width, height, depth, len(frames)), dtype=dtype)
+        for i, (start, stop) in enumerate(spans):
+            buffer = b"".join(
+                blockdata[b][max(start, b * bs) - b * bs:min(stop, (b + 1) * bs) - b * bs]
+                for b in range(start // bs, (stop - 1) // bs + 1)
+            )
+            span = np.frombuffer(buffer, dtype=dtype)
+            result[:, :, i % depth, i // depth] = np.lib.stride_tricks.as_strided(
+                span, shape=(width, height), strides=(dtype.itemsize, nx * dtype.itemsize)
+            )
+        if mapindex is not None or len(shape) == 3:
+            result = result[:, :, :, 0]
+        slope, inter = header.get_slope_inter()
+        return apply_read_scaling(result, slope, inter)
 
     def get_shape(self, resolution_mm=None):
         if resolution_mm is not None:
@@ -285,7 +399,7 @@ class RemoteNiftiVolume(ImageProvider, VolumeSrc, volume_type="nii"):
                 "NiftiVolume does not support to specify different image resolutions"
             )
         try:
-            return self.image.shape
+            return self.header.get_data_shape()
         except AttributeError as e:
             logger.error(
                 f"Invalid object type {type(self.image)} of image for {self} {self.name}"
@@ -293,7 +407,7 @@ class RemoteNiftiVolume(ImageProvider, VolumeSrc, volume_type="nii"):
             raise (e)
 
     def is_float(self):
-        return self.image.dataobj.dtype.kind == "f"
+        return self.header.get_data_dtype().kind == "f"
 
 
 class NeuroglancerVolume(
@@ -303,6 +417,8 @@ class NeuroglancerVolume(
     # Gigabyte size that is considered feasible for ad-hoc downloads of
     # neuroglancer volume data. This is used to avoid accidental huge downloads.
     _cached_volume = None
+    _info_cached = None
+    _resolutions_cached = None
 
     def __init__(
         self,
@@ -320,22 +436,49 @@ class NeuroglancerVolume(
         """
         super().__init__(identifier, name, url, space, detail)
         self.transform_nm = transform_nm
-        self.info = HttpRequest(url + "/info", lambda b: json.loads(b.decode())).get()
-        self.nbytes = np.dtype(self.info["data_type"]).itemsize
-        self.num_scales = len(self.info["scales"])
-        self.mip_resolution_mm = {
+        self._info_loader = LazyHttpRequest(url + "/info", requests.decode_json)
+
+    @property
+    def info(self):
+        """
+        The info file of the precomputed volume. It is only retrieved on first
+        use, so that building the configuration does not require it.
+        """
+        if self._info_cached is None:
+            self._info_cached = self._info_loader.data
+        return self._info_cached
+
+    @property
+    def nbytes(self):
+        return np.dtype(self.info["data_type"]).itemsize
+
+    @property
+    def num_scales(self):
+        return len(self.info["scales"])
+
+    @property
+    def mip_resolution_mm(self):
+        return {
             i: np.min(v["resolution"]) / (1000 ** 2)
             for i, v in enumerate(self.info["scales"])
         }
-        self.resolutions_available = {
-            np.min(v["resolution"])
-            / (1000 ** 2): {
-                "mip": i,
-                "GBytes": np.prod(v["size"]) * self.nbytes / (1024 ** 3),
+
+    @property
+    def resolutions_available(self):
+        if self._resolutions_cached is None:
+            self._resolutions_cached = {
+                np.min(v["resolution"])
+                / (1000 ** 2): {
+                    "mip": i,
+                    "GBytes": np.prod(v["size"]) * self.nbytes / (1024 ** 3),
+                }
+                for i, v in enumerate(self.info["scales"])
             }
-            for i, v in enumerate(self.info["scales"])
-        }
-        self.helptext = "\n".join(
+        return self._resolutions_cached
+
+    @property
+    def helptext(self):
+        return "\n".join(
             [
                 "{:7.4f} mm {:10.4f} GByte".format(k, v["GBytes"])
                 for k, v in self.resolutions_available.items()
@@ -464,20 +607,13 @@ class NeuroglancerVolume(
             f"Loading neuroglancer data at a resolution of {effective_res_mm} mm (mip={mip})"
         )
 
-        maxdims = tuple(np.array(self.volume.mip_shape(mip)[:3]) - 1)
-        if voi is None:
-            bbox_vox = BoundingBox([0, 0, 0], maxdims, space=None)
-        else:
-            bbox_vox = voi.transform(
-                np.linalg.inv(self.build_affine(effective_res_mm)),
-            ).clip(maxdims)
-
+        bbox_vox = self._voxel_bbox(mip, voi)
         if bbox_vox is None:
             # zero size bounding box, return empty array
             return np.empty((0, 0, 0))
 
         # estimate size and check feasibility
-        gbytes = bbox_vox._Bbox.volume() * self.nbytes / (1024 ** 3)
+        gbytes = bbox_vox.volume() * self.nbytes / (1024 ** 3)
         if gbytes > gbyte_feasible:
             # TODO would better do an estimate of the acutal data size
             logger.error(
@@ -487,26 +623,244 @@ class NeuroglancerVolume(
             )
             print(self.helptext)
             raise NotImplementedError(
-                f"Request of the whole full-resolution volume in one piece is prohibited as of now due to the estimated size of ~{gbytes:.0f} GByte."
+                f"Request of the whole full-resolution volume in one piece is prohibited as of now due to the estimated size of ~{gbytes:.0f} GByte. "
+                "Use fetch_tiles() or fetch_to_file() to retrieve it in tiles."
             )
 
         # ok, retrieve data now.
-        cachefile = CACHE.build_filename(
-            f"{self.url}{bbox_vox._Bbox.serialize()}{str(mip)}", suffix="npy"
-        )
-        if os.path.exists(cachefile):
-            logger.debug(f"NgVolume loads from cache file {cachefile}")
-            return np.load(cachefile)
+        try:
+            return self._load_chunks(mip, bbox_vox)
+        except OutOfBoundsError as e:
+            logger.error("Bounding box does not match image.")
+            print(str(e))
+            return np.empty((0, 0, 0))
+
+    def _voxel_bbox(self, mip, voi):
+        # voxel bounding box (cloudvolume Bbox) of a volume of interest at the
+        # given mip, clipped to the volume, or None if they do not intersect.
+        maxdims = tuple(np.array(self.info["scales"][mip]["size"][:3]) - 1)
+        if voi is None:
+            bbox_vox = BoundingBox([0, 0, 0], maxdims, space=None)
         else:
-            try:
-                logger.debug(f"NgVolume downloads (mip={mip}, bbox={bbox_vox}")
-                data = self.volume.download(bbox=bbox_vox._Bbox, mip=mip)
-                np.save(cachefile, np.array(data))
-                return np.array(data)
-            except OutOfBoundsError as e:
-                logger.error("Bounding box does not match image.")
-                print(str(e))
-                return np.empty((0, 0, 0))
+            bbox_vox = voi.transform(
+                np.linalg.inv(self.build_affine(self.mip_resolution_mm[mip])),
+            ).clip(maxdims)
+        return None if bbox_vox is None else bbox_vox._Bbox
+
+    def _tiles(self, mip, bbox, tile_gbytes):
+        """
+        Split a voxel bounding box into tiles of at most the given size,
+        aligned to the chunk grid so that no chunk is downloaded twice.
+        Tiles are extended along x, then y, then z in multiples of the
+        chunk size, but never fall below a single chunk.
+        """
+        scale = self.info["scales"][mip]
+        chunksize = np.array(scale["chunk_sizes"][0])
+        offset = np.array(scale.get("voxel_offset", [0, 0, 0]))
+        minpt, maxpt = np.array(bbox.minpt, dtype=int), np.array(bbox.maxpt, dtype=int)
+        start = offset + (minpt - offset) // chunksize * chunksize
+        maxvoxels = tile_gbytes * 1024 ** 3 / (self.nbytes * self.info.get("num_channels", 1))
+        tilesize = chunksize.copy()
+        for axis in range(3):
+            nchunks = -(-(maxpt[axis] - start[axis]) // chunksize[axis])
+            others = np.prod(tilesize) // tilesize[axis]
+            factor = int(maxvoxels // (others * chunksize[axis]))
+            tilesize[axis] = max(1, min(nchunks, factor)) * chunksize[axis]
+        for corner in product(*(range(a, b, t) for a, b, t in zip(start, maxpt, tilesize))):
+            yield Bbox(np.maximum(corner, minpt), np.minimum(np.array(corner) + tilesize, maxpt))
+
+    def fetch_tiles(self, resolution_mm=None, voi=None, tile_gbytes=None):
+        """
+        Iterate over the image data of a volume of interest tile by tile.
+        Unlike fetch(), this is not limited by the feasible download size
+        (see siibra.set_feasible_download_size), since only one tile is
+        held in memory at a time.
+
+        Parameters:
+        -----------
+        resolution_mm : desired resolution in mm
+        voi : BoundingBox
+            optional bounding box
+        tile_gbytes : float, or None
+            maximum size of a tile in GByte. If None, the feasible download size is used.
+
+        Yields:
+        -------
+        (bbox, data, affine) of each tile, where bbox is the voxel bounding box
+        of the tile (cloudvolume Bbox), and affine maps the voxels of data to
+        physical space.
+        """
+        mip = self._resolution_to_mip(resolution_mm, voi=voi)
+        bbox = self._voxel_bbox(mip, voi)
+        if bbox is None:
+            return
+        affine = self.build_affine(self.mip_resolution_mm[mip])
+        for tile in self._tiles(mip, bbox, tile_gbytes or gbyte_feasible):
+            data = self._load_chunks(mip, tile)
+            if data.shape[3] == 1:
+                data = data.squeeze(axis=3)
+            shift = np.identity(4)
+            shift[:3, -1] = tile.minpt
+            yield tile, data, np.dot(affine, shift)
+
+    def fetch_to_file(self, filename, resolution_mm=None, voi=None, tile_gbytes=None):
+        """
+        Write the image data of a volume of interest tile by tile to an
+        uncompressed NIfTI file, and return the image memory-mapped from
+        this file. Like fetch_tiles(), this is not limited by the
+        feasible download size, and only one tile is held in memory at a time.
+
+        Parameters:
+        -----------
+        filename : str
+            name of the NIfTI file to write, should end with ".nii"
+        resolution_mm : desired resolution in mm
+        voi : BoundingBox
+            optional bounding box
+        tile_gbytes : float, or None
+            maximum size of a tile in GByte. If None, the feasible download size is used.
+        """
+        mip = self._resolution_to_mip(resolution_mm, voi=voi)
+        bbox = self._voxel_bbox(mip, voi)
+        if bbox is None:
+            raise RuntimeError(f"The volume of interest does not intersect {self.name}.")
+        minpt = np.array(bbox.minpt, dtype=int)
+        shape = tuple(np.array(bbox.maxpt, dtype=int) - minpt)
+        if self.info.get("num_channels", 1) > 1:
+            shape = shape + (self.info["num_channels"],)
+        shift = np.identity(4)
+        shift[:3, -1] = minpt
+        affine = np.dot(self.build_affine(self.mip_resolution_mm[mip]), shift)
+
+        header = nibabel.Nifti1Header()
+        header.set_data_dtype(np.dtype(self.info["data_type"]))
+        header.set_data_shape(shape)
+        header.set_qform(affine, code="aligned")
+        header.set_sform(affine, code="aligned")
+        header.set_data_offset(NIFTI_DATA_OFFSET)
+        with open(filename, "wb") as f:
+            header.write_to(f)
+            f.truncate(NIFTI_DATA_OFFSET + int(np.prod(shape)) * self.nbytes)
+
+        output = np.memmap(
+            filename, dtype=header.get_data_dtype(), mode="r+",
+            offset=NIFTI_DATA_OFFSET, shape=shape, order="F"
+        )
+        for tile, data, _ in self.fetch_tiles(resolution_mm, voi, tile_gbytes):
+            lo = np.array(tile.minpt, dtype=int) - minpt
+            hi = np.array(tile.maxpt, dtype=int) - minpt
+            output[tuple(slice(a, b) for a, b in zip(lo, hi))] = data
+        output.flush()
+        del output
+        return nibabel.load(filename)
+
+    def _chunk_cachefile(self, mip, minpt, maxpt):
+        # cache file of a chunk, named like the chunk files of the precomputed format
+        name = "_".join(f"{x0}-{x1}" for x0, x1 in zip(minpt, maxpt))
+        return CACHE.build_filename(f"{self.url}/{mip}/{name}", suffix="npy")
+
+    def _load_chunks(self, mip, bbox):
+        """
+        Assemble the image data of a voxel bounding box at the given mip from
+        the chunks of the volume's native chunk grid. Chunks are cached
+        individually, so that overlapping requests share them, and only
+        chunks which are not yet cached are downloaded.
+        """
+        minpt, maxpt = np.array(bbox.minpt, dtype=int), np.array(bbox.maxpt, dtype=int)
+        chunks = [
+            (c0, c1, self._chunk_cachefile(mip, c0, c1))
+            for c0, c1 in self._enclosing_chunkgrid(mip, bbox)
+        ]
+        missing = []
+        for chunk in chunks:
+            if CACHE.available(chunk[2]):
+                CACHE.hit(chunk[2])
+                METRICS.hit("disk")
+            else:
+                missing.append(chunk)
+        if len(missing) > 0:
+            self._retrieve_chunks(mip, missing)
+        if requests.RECORDER is not None:
+            for c0, c1, cachefile in chunks:
+                requests.RECORDER.record_cutout(self.url, Bbox(c0, c1).serialize(), mip, cachefile)
+
+        if len(chunks) == 1 and all(chunks[0][0] == minpt) and all(chunks[0][1] == maxpt):
+            # the request matches a single chunk, which is returned memory-mapped
+            # so that processes reading the same chunk share its page cache.
+            # It is mapped copy-on-write, since callers may modify the array in place.
+            return np.load(chunks[0][2], mmap_mode="c")
+        channels = self.info.get("num_channels", 1)
+        result = np.zeros(tuple(maxpt - minpt) + (channels,), dtype=self.info["data_type"])
+        for c0, c1, cachefile in chunks:
+            lo, hi = np.maximum(c0, minpt), np.minimum(c1, maxpt)
+            target = tuple(slice(a, b) for a, b in zip(lo - minpt, hi - minpt))
+            source = tuple(slice(a, b) for a, b in zip(lo - c0, hi - c0))
+            result[target] = np.load(cachefile, mmap_mode="r")[source]
+        return result
+
+    def _retrieve_chunks(self, mip, chunks):
+        """
+        Download the given chunks (minpoint, maxpoint, cachefile) of a mip
+        into the cache. They are downloaded in boxes of adjacent chunks,
+        each holding a lock, so that concurrent processes requesting the
+        same chunks download them only once.
+        """
+        if requests.OFFLINE:
+            raise RuntimeError(
+                f"siibra runs in offline mode (SIIBRA_OFFLINE), but the requested "
+                f"data of {self.url} is not available in the cache."
+            )
+        for box in self._chunk_boxes(mip, chunks):
+            lo = np.min([c0 for c0, _, _ in box], axis=0)
+            hi = np.max([c1 for _, c1, _ in box], axis=0)
+            with CACHE.lock(self._chunk_cachefile(mip, lo, hi)):
+                # other processes may have downloaded some chunks while we were waiting
+                remaining = [c for c in box if not CACHE.available(c[2])]
+                for subbox in self._chunk_boxes(mip, remaining):
+                    self._download_chunks(mip, subbox)
+
+    def _chunk_boxes(self, mip, chunks):
+        """
+        Group chunks (minpoint, maxpoint, cachefile) of a mip into boxes of
+        adjacent chunks, which are downloaded at once without including
+        any other chunks. Boxes are grown along x, then y, then z.
+        """
+        scale = self.info["scales"][mip]
+        chunksize = np.array(scale["chunk_sizes"][0])
+        offset = np.array(scale.get("voxel_offset", [0, 0, 0]))
+        remaining = {tuple((c[0] - offset) // chunksize): c for c in chunks}
+        boxes = []
+        for start in sorted(remaining, key=lambda index: index[::-1]):
+            if start not in remaining:
+                continue
+            size = np.ones(3, dtype=int)
+            for axis in range(3):
+                while True:
+                    # the layer of chunks adjacent to the box along the axis
+                    shape = size.copy()
+                    shape[axis] = 1
+                    step = np.identity(3, dtype=int)[axis] * size[axis]
+                    layer = [tuple(np.add(start, step) + d) for d in np.ndindex(*shape)]
+                    if not all(index in remaining for index in layer):
+                        break
+                    size[axis] += 1
+            boxes.append([remaining.pop(tuple(np.add(start, d))) for d in np.ndindex(*size)])
+        return boxes
+
+    def _download_chunks(self, mip, chunks):
+        # Download a box of adjacent chunks at once,
+        # which lets cloudvolume fetch them in parallel, and cache each chunk.
+        lo = np.min([c0 for c0, _, _ in chunks], axis=0)
+        hi = np.max([c1 for _, c1, _ in chunks], axis=0)
+        METRICS.miss("disk")
+        logger.debug(f"NgVolume downloads {len(chunks)} chunks (mip={mip}, bbox={lo}-{hi})")
+        start = time.time()
+        data = np.asarray(self.volume.download(bbox=Bbox(lo, hi), mip=mip))
+        METRICS.download(self.url, data.nbytes, time.time() - start)
+        for c0, c1, cachefile in chunks:
+            with CACHE.atomic_write(cachefile) as f:
+                np.save(f, data[tuple(slice(a, b) for a, b in zip(c0 - lo, c1 - lo))])
+            CACHE.add(cachefile, self.url)
 
     def fetch(self, resolution_mm=None, voi=None, mapindex=None, clip=False):
         """
@@ -545,34 +899,27 @@ class NeuroglancerVolume(
     def __hash__(self):
         return hash(self.url) + hash(self.transform_nm)
 
-    def _enclosing_chunkgrid(self, mip, bbox_phys):
+    def _enclosing_chunkgrid(self, mip, bbox):
         """
-        Produce grid points representing the chunks of the mip
-        which enclose a given bounding box. The bounding box is given in
-        physical coordinates, but the grid is returned in voxel spaces of the
-        given mip.
+        Returns the (minpoint, maxpoint) voxel coordinates of the chunks
+        of the given mip which intersect a bounding box, given in
+        voxel coordinates of the mip. Chunks are clipped to the volume bounds.
         """
-
-        # some helperfunctions to produce the smallest range on a grid enclosing another range
-        def cfloor(x, s):
-            int(np.floor(x / s) * s)
-
-        def cceil(x, s):
-            int(np.ceil(x / s) * s) + 1
-
-        def crange(x0, x1, s):
-            np.arange(cfloor(x0, s), cceil(x1, s), s)
-
-        # project the bounding box to the voxel grid of the selected mip
-        bb = np.dot(
-            np.linalg.inv(self.build_affine(self.mip_resolution_mm[mip])), bbox_phys
-        )
-
-        # compute the enclosing chunk grid
-        chunksizes = self.volume.scales[mip]["chunk_sizes"][0]
-        x, y, z = [crange(bb[i][0], bb[i][1], chunksizes[i]) for i in range(3)]
-        xx, yy, zz = np.meshgrid(x, y, z)
-        return np.vstack([xx.ravel(), yy.ravel(), zz.ravel(), zz.ravel() * 0 + 1])
+        scale = self.info["scales"][mip]
+        chunksize = np.array(scale["chunk_sizes"][0])
+        offset = np.array(scale.get("voxel_offset", [0, 0, 0]))
+        end = offset + np.array(scale["size"])
+        minpt = np.maximum(np.array(bbox.minpt, dtype=int), offset)
+        maxpt = np.minimum(np.array(bbox.maxpt, dtype=int), end)
+        if any(maxpt <= minpt):
+            return []
+        first = (minpt - offset) // chunksize
+        last = (maxpt - 1 - offset) // chunksize
+        chunks = []
+        for index in np.ndindex(*(last - first + 1)):
+            c0 = offset + (first + np.array(index)) * chunksize
+            chunks.append((c0, np.minimum(c0 + chunksize, end)))
+        return chunks
 
 
 class DetailedMapsVolume(VolumeSrc, volume_type="detailed maps"):
@@ -0,0 +1,59 @@
+import unittest
+
+from siibra.commons import LazyElement, Registry
+
+
+class Element(LazyElement):
+
+    def __init__(self, name, built):
+        self.name = name
+        self.built = built
+
+    def build(self):
+        self.built.append(self.name)
+        return f"built {self.name}"
+
+    def matches(self, spec):
+        return spec == self.name.upper()
+
+
+class TestLazyRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.built = []
+        self.registry = Registry(elements={
+            "a": Element("a", self.built),
+            "b": Element("b", self.built),
+            "c": "plain c",
+        })
+
+    def test_elements_are_built_on_access(self):
+        self.assertEqual(len(self.registry), 3)
+        self.assertIn("a", self.registry)
+        self.assertEqual(self.built, [])
+        self.assertEqual(self.registry["b"], "built b")
+        self.assertEqual(self.built, ["b"])
+        self.assertEqual(self.registry["b"], "built b")
+        self.assertEqual(self.built, ["b"])
+
+    def test_matching_without_building(self):
+        self.assertTrue(self.registry.provides("A"))
+        self.assertFalse(self.registry.provides("D"))
+        self.assertEqual(self.built, [])
+        self.assertEqual(self.registry["A"], "built a")
+        self.assertEqual(self.built, ["a"])
+
+    def test_iteration_builds_all_elements(self):
+        self.assertEqual(list(self.registry), ["built a", "built b", "plain c"])
+        self.assertEqual(self.built, ["a", "b"])
+
+    def test_removal(self):
+        self.registry["a"]
+        remaining = self.registry - "built a"
+        self.assertEqual(len(remaining), 2)
+        self.assertNotIn("a", remaining)
+        self.assertEqual(self.built, ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import os
+import uuid
+
+from siibra.core import concept
+from siibra.core.concept import AtlasConcept, _ConceptStub
+from siibra.commons import Registry
+from siibra.retrieval.cache import CACHE
+
+
+class TestRegistrySnapshots(unittest.TestCase):
+
+    def setUp(self):
+        # like in provide_registry, the class is not bound in any module
+        # when the snapshot is taken
+        class Concept(AtlasConcept):
+            @classmethod
+            def _from_json(cls, obj):
+                return cls(obj["@id"], obj["name"], [])
+
+        Concept.__name__ = f"Concept{uuid.uuid4().hex}"
+        concept._REGISTRY_CLASSES[Concept.__name__] = Concept
+        Concept.REGISTRY = Registry(matchfunc=Concept.match_spec)
+        for name in ["first concept", "second concept"]:
+            stub = _ConceptStub(Concept, {"@id": name.upper(), "name": name}, f"{name}.json")
+            Concept.REGISTRY.add(stub.key, stub)
+        self.cls = Concept
+
+    def tearDown(self):
+        del concept._REGISTRY_CLASSES[self.cls.__name__]
+        fname = concept._snapshot_filename(self.cls)
+        if os.path.isfile(fname):
+            os.remove(fname)
+            CACHE.index.remove(fname)
+
+    def test_snapshot_roundtrip(self):
+        self.assertFalse(concept._load_snapshot(self.cls))
+        concept._save_snapshot(self.cls)
+        self.assertTrue(os.path.isfile(concept._snapshot_filename(self.cls)))
+
+        self.cls.REGISTRY = None
+        self.assertTrue(concept._load_snapshot(self.cls))
+        self.assertEqual(len(self.cls.REGISTRY), 2)
+        self.assertTrue(self.cls.REGISTRY.provides("second"))
+        obj = self.cls.REGISTRY["second"]
+        self.assertIsInstance(obj, self.cls)
+        self.assertEqual(obj.id, "SECOND CONCEPT")
+
+
+if __name__ == "__main__":
+    unittest.main()
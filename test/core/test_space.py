@@ -2,7 +2,7 @@ from siibra.retrieval.requests import LazyHttpRequest, ZipfileRequest
 import unittest
 
 from siibra import atlases
-from siibra.core import Space
+from siibra.core import Space, Point
 
 
 class TestSpaces(unittest.TestCase):
@@ -77,6 +77,11 @@ class TestSpaces(unittest.TestCase):
         spaces = atlases.MULTILEVEL_HUMAN_ATLAS.spaces
         self.assertEqual(len(spaces), 4)
 
+    def test_point_warp_without_space(self):
+        space = Space._from_json(self.json_space_without_zip)
+        with self.assertRaises(ValueError):
+            Point((1, 2, 3), None).warp(space)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,255 @@
+import unittest
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from siibra.retrieval import cache
+from siibra.retrieval.cache import Cache, CacheIndex, MemoryCache, parse_bytesize
+
+
+class TestCacheIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.index = CacheIndex(self.folder)
+
+    def tearDown(self):
+        self.index.close()
+
+    def _write(self, name, nbytes):
+        fname = os.path.join(self.folder, name)
+        with open(fname, "wb") as f:
+            f.write(b"x" * nbytes)
+        self.index.add(fname, url=f"http://localhost/{name}")
+        return fname
+
+    def test_size(self):
+        self._write("a", 10)
+        self._write("b", 20)
+        self.assertEqual(self.index.size, 30)
+
+    def _accessed(self, name):
+        # access time of an entry as seen by another process
+        other = CacheIndex(self.folder)
+        try:
+            return dict(
+                other._db.execute("SELECT filename, accessed FROM entries").fetchall()
+            )[name]
+        finally:
+            other.close()
+
+    def test_hits_are_flushed_after_count(self):
+        fname = self._write("a", 10)
+        self._write("b", 10)
+        before = self._accessed("a")
+        flushcount = cache.HIT_FLUSH_COUNT
+        cache.HIT_FLUSH_COUNT = 2
+        try:
+            time.sleep(0.01)
+            self.index.hit(fname)
+            self.assertEqual(self._accessed("a"), before)
+            self.index.hit("b")
+            self.assertGreater(self._accessed("a"), before)
+        finally:
+            cache.HIT_FLUSH_COUNT = flushcount
+
+    def test_hits_are_flushed_after_interval(self):
+        fname = self._write("a", 10)
+        before = self._accessed("a")
+        interval = cache.HIT_FLUSH_INTERVAL
+        cache.HIT_FLUSH_INTERVAL = 0.05
+        try:
+            self.index.hit(fname)
+            time.sleep(0.3)
+            self.assertGreater(self._accessed("a"), before)
+        finally:
+            cache.HIT_FLUSH_INTERVAL = interval
+
+    def test_lru_order(self):
+        for name in "abc":
+            self._write(name, 10)
+        self.index.hit("a")
+        names = [name for name, _ in self.index.candidates("lru")]
+        self.assertEqual(names, ["b", "c", "a"])
+
+    def test_lfu_order(self):
+        for name in "abc":
+            self._write(name, 10)
+        self.index.hit("c")
+        self.index.hit("c")
+        self.index.hit("a")
+        names = [name for name, _ in self.index.candidates("lfu")]
+        self.assertEqual(names, ["b", "a", "c"])
+
+    def test_unindexed_files_are_scanned(self):
+        with open(os.path.join(self.folder, "old"), "wb") as f:
+            f.write(b"x" * 5)
+        self.index.scan()
+        self.assertEqual(self.index.size, 5)
+
+    def test_validators(self):
+        fname = self._write("a", 10)
+        self.assertIsNone(self.index.validator(fname))
+        self.index.set_validator(fname, etag='"v1"')
+        etag, modified, _ = self.index.validator(fname)
+        self.assertEqual((etag, modified), ('"v1"', None))
+        self.index.remove(fname)
+        self.assertIsNone(self.index.validator(fname))
+
+    def test_parse_bytesize(self):
+        self.assertEqual(parse_bytesize("1000"), 1000)
+        self.assertEqual(parse_bytesize("2k"), 2048)
+        self.assertEqual(parse_bytesize("1.5G"), int(1.5 * 1024 ** 3))
+        with self.assertRaises(ValueError):
+            parse_bytesize("lots")
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache.__new__(Cache)
+        self.cache.folder = tempfile.mkdtemp()
+        self.cache.index = CacheIndex(self.cache.folder)
+
+    def tearDown(self):
+        self.cache.index.close()
+
+    def test_eviction_removes_files(self):
+        self.cache.maxbytes = 25
+        names = []
+        for name in "abc":
+            fname = self.cache.build_filename(name)
+            with self.cache.atomic_write(fname) as f:
+                f.write(b"x" * 10)
+            self.cache.add(fname)
+            names.append(fname)
+            time.sleep(0.01)
+        # adding the third entry exceeded the limit, so the least recently used one is removed
+        self.assertFalse(os.path.isfile(names[0]))
+        self.assertTrue(os.path.isfile(names[1]))
+        self.assertTrue(os.path.isfile(names[2]))
+        self.assertEqual(self.cache.size, 20)
+        self.cache.hit(names[1])
+        self.assertEqual(self.cache.evict(maxbytes=10), 10)
+        self.assertFalse(os.path.isfile(names[2]))
+        self.assertTrue(os.path.isfile(names[1]))
+
+    def test_remove_partials(self):
+        old = self.cache.build_filename("old") + ".part"
+        recent = self.cache.build_filename("recent") + ".part"
+        for fname in [old, recent]:
+            with open(fname, "wb") as f:
+                f.write(b"x" * 10)
+        past = time.time() - 2 * 24 * 3600
+        os.utime(old, (past, past))
+        self.assertEqual(self.cache.remove_partials(), 10)
+        self.assertFalse(os.path.isfile(old))
+        self.assertTrue(os.path.isfile(recent))
+
+    def test_partials_are_removed_once_within_maxage(self):
+        past = time.time() - 2 * 24 * 3600
+        for name in ["first", "second"]:
+            fname = self.cache.build_filename(name) + ".part"
+            with open(fname, "wb") as f:
+                f.write(b"x" * 10)
+            os.utime(fname, (past, past))
+            self.assertEqual(self.cache._remove_partials_if_due(), 10 if name == "first" else 0)
+        self.assertTrue(os.path.isfile(fname))
+
+    def test_lock_files_are_bounded(self):
+        for i in range(2 * cache.LOCK_SLOTS):
+            with self.cache.lock(self.cache.build_filename(str(i))):
+                pass
+        lockfiles = os.listdir(os.path.join(self.cache.folder, cache.LOCK_FOLDER))
+        self.assertLessEqual(len(lockfiles), cache.LOCK_SLOTS)
+
+    def test_nested_locks(self):
+        fname = self.cache.build_filename("nested")
+        with self.cache.lock(fname):
+            with self.cache.lock(fname):
+                pass
+
+    def test_lock_excludes_threads(self):
+        fname = self.cache.build_filename("shared")
+        active = []
+        overlaps = []
+
+        def work():
+            with self.cache.lock(fname):
+                active.append(1)
+                time.sleep(0.01)
+                overlaps.append(len(active) > 1)
+                active.pop()
+
+        threads = [threading.Thread(target=work) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(overlaps, [False] * 5)
+
+
+class TestSharedCacheFolders(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = Cache.__new__(Cache)
+        self.cache.folder = tempfile.mkdtemp()
+        self.cache.index = CacheIndex(self.cache.folder)
+        self.cache.shared_folders = [tempfile.mkdtemp()]
+        self.filename = self.cache.build_filename("http://localhost/shared")
+        with open(os.path.join(self.cache.shared_folders[0], os.path.basename(self.filename)), "wb") as f:
+            f.write(b"shared")
+
+    def tearDown(self):
+        self.cache.index.close()
+
+    def test_build_filename_has_no_side_effects(self):
+        self.cache.build_filename("http://localhost/shared")
+        self.assertFalse(os.path.lexists(self.filename))
+        self.assertTrue(self.cache.exists(self.filename))
+        self.assertFalse(os.path.lexists(self.filename))
+
+    def test_shared_entries_are_linked(self):
+        self.cache.promote = False
+        self.assertTrue(self.cache.available(self.filename))
+        self.assertTrue(os.path.islink(self.filename))
+        with open(self.filename, "rb") as f:
+            self.assertEqual(f.read(), b"shared")
+
+    def test_shared_entries_are_promoted(self):
+        self.cache.promote = True
+        self.assertTrue(self.cache.available(self.filename))
+        self.assertFalse(os.path.islink(self.filename))
+        self.assertEqual(self.cache.size, len(b"shared"))
+
+    def test_missing_entries(self):
+        filename = self.cache.build_filename("http://localhost/missing")
+        self.assertFalse(self.cache.exists(filename))
+        self.assertFalse(self.cache.available(filename))
+
+
+class TestMemoryCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        memcache = MemoryCache(maxbytes=250)
+        for key in "abc":
+            memcache.put(key, np.zeros(100, dtype="uint8"))
+        self.assertIsNone(memcache.get("a"))
+        self.assertIsNotNone(memcache.get("b"))
+        memcache.put("d", np.zeros(100, dtype="uint8"))
+        self.assertIsNone(memcache.get("c"))
+        self.assertIsNotNone(memcache.get("b"))
+        self.assertLessEqual(memcache.nbytes, 250)
+
+    def test_oversized_objects_are_not_cached(self):
+        memcache = MemoryCache(maxbytes=10)
+        memcache.put("a", np.zeros(100, dtype="uint8"))
+        self.assertIsNone(memcache.get("a"))
+        self.assertEqual(len(memcache), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
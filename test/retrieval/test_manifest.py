@@ -0,0 +1,136 @@
+import unittest
+import functools
+import http.server
+import os
+import tempfile
+import threading
+import uuid
+from unittest.mock import patch
+
+from siibra.retrieval import Manifest, HttpRequest, ZipfileRequest, requests
+from siibra.retrieval.requests import HttpRangeRequest, read_cachefile
+from siibra.retrieval.cache import CACHE
+
+
+class QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class TestManifest(unittest.TestCase):
+
+    def test_missing_entries(self):
+        folder = tempfile.mkdtemp()
+        manifest = Manifest("test")
+        manifest.add("http://localhost/a", os.path.join(folder, "a"))
+        manifest.add("http://localhost/b", os.path.join(folder, "b"))
+        with open(os.path.join(folder, "a"), "w") as f:
+            f.write("content")
+        self.assertEqual(manifest.missing(folder), ["http://localhost/b"])
+
+    def test_save_and_load(self):
+        manifest = Manifest("test")
+        manifest.add("http://localhost/a")
+        filename = os.path.join(tempfile.mkdtemp(), "manifest.json")
+        manifest.save(filename)
+        loaded = Manifest.load(filename)
+        self.assertEqual(loaded.tag, "test")
+        self.assertEqual(loaded.entries, manifest.entries)
+
+    def test_recorded_requests(self):
+        manifest = Manifest("test")
+        manifest.record(HttpRequest("http://localhost/a"))
+        loader = HttpRequest(
+            "http://localhost/b", headers={"Range": "bytes=0-9", "Authorization": "Bearer secret"}
+        )
+        manifest.record(loader)
+        self.assertEqual(len(manifest), 2)
+        spec = manifest.requests[os.path.basename(loader.cachefile)]
+        self.assertEqual(spec["kwargs"]["headers"], {"Range": "bytes=0-9"})
+        filename = os.path.join(tempfile.mkdtemp(), "manifest.json")
+        manifest.save(filename)
+        loaded = Manifest.load(filename)
+        self.assertEqual(loaded.requests, manifest.requests)
+        self.assertEqual(len(loaded.missing(tempfile.mkdtemp())), 2)
+
+    def test_extracted_members_are_recorded(self):
+        loader = ZipfileRequest("http://localhost/archive.zip", "member.txt")
+        with open(loader.member_cachefile, "wb") as f:
+            f.write(b"content")
+        requests.RECORDER = Manifest("test")
+        try:
+            self.assertEqual(loader.get(), "content")
+            self.assertEqual(requests.RECORDER.entries, {loader.url: os.path.basename(loader.cachefile)})
+        finally:
+            requests.RECORDER = None
+            os.remove(loader.member_cachefile)
+            CACHE.index.remove(loader.member_cachefile)
+
+
+class TestReplay(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        with open(os.path.join(cls.folder, "a.txt"), "w") as f:
+            f.write("content")
+        cls.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            functools.partial(QuietRequestHandler, directory=cls.folder)
+        )
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.baseurl = f"http://127.0.0.1:{self.server.server_port}"
+        self.cachefiles = []
+
+    def tearDown(self):
+        requests.RECORDER = None
+        for fname in self.cachefiles:
+            if os.path.isfile(fname):
+                os.remove(fname)
+                CACHE.index.remove(fname)
+
+    def test_failed_retrievals_are_not_recorded(self):
+        requests.RECORDER = Manifest("test")
+        loader = HttpRequest(f"http://localhost/{uuid.uuid4().hex}")
+        with patch.object(requests, "OFFLINE", True):
+            with self.assertRaises(RuntimeError):
+                loader._retrieve()
+        self.assertEqual(len(requests.RECORDER), 0)
+
+    def test_replay_skips_failures(self):
+        manifest = Manifest("test")
+        existing = HttpRequest(f"{self.baseurl}/a.txt?{uuid.uuid4().hex}")
+        missing = HttpRequest(f"{self.baseurl}/{uuid.uuid4().hex}.txt")
+        self.cachefiles.extend([existing.cachefile, missing.cachefile])
+        manifest.add(existing.url)
+        manifest.add(missing.url)
+        count, failed = manifest.replay()
+        self.assertEqual(count, 1)
+        self.assertEqual(failed, [missing.url])
+        self.assertEqual(read_cachefile(existing.cachefile), b"content")
+
+    def test_range_requests_are_replayed(self):
+        manifest = Manifest("test")
+        loader = HttpRangeRequest(f"{self.baseurl}/a.txt?{uuid.uuid4().hex}", 0, 3)
+        self.cachefiles.append(loader.cachefile)
+        manifest.record(loader)
+        self.assertEqual(
+            list(manifest.requests.values()),
+            [{"url": loader.url, "kind": "range", "start": 0, "stop": 3}]
+        )
+        # the test server does not support range requests, which only a range request detects
+        count, failed = manifest.replay()
+        self.assertEqual(count, 0)
+        self.assertEqual(failed, [loader.url])
+        self.assertFalse(os.path.isfile(loader.cachefile))
+
+
+if __name__ == "__main__":
+    unittest.main()
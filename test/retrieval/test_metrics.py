@@ -0,0 +1,34 @@
+import unittest
+
+from siibra.retrieval.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_downloads_are_attributed_to_triggers(self):
+        metrics = Metrics()
+        with metrics.trigger("registry"):
+            with metrics.trigger("query"):
+                metrics.download("https://example.org/a", 10, 0.5)
+            metrics.download("https://example.org/b", 5, 20)
+        metrics.download("https://other.org/c", 1, 0.001)
+        result = metrics.as_dict()
+        self.assertEqual(result["bytes_per_host"], {"example.org": 15, "other.org": 1})
+        self.assertEqual(result["triggers"]["query"], {"downloads": 1, "bytes": 10})
+        self.assertEqual(result["triggers"]["registry"], {"downloads": 1, "bytes": 5})
+        self.assertEqual(result["triggers"]["other"], {"downloads": 1, "bytes": 1})
+        self.assertEqual(sum(result["latencies"]["download"].values()), 3)
+        self.assertEqual(result["latencies"]["download"]["<=100.0s"], 1)
+
+    def test_hits_and_misses(self):
+        metrics = Metrics()
+        metrics.hit("disk")
+        metrics.hit("disk")
+        metrics.miss("memory")
+        result = metrics.as_dict()
+        self.assertEqual(result["hits"], {"disk": 2})
+        self.assertEqual(result["misses"], {"memory": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import uuid
+from zipfile import ZipFile
+
+from siibra.retrieval import GitlabConnector, HttpRequest, ZipfileRequest
+from siibra.retrieval.cache import CACHE
+
+
+class TestGitlabArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.connector = GitlabConnector(
+            "https://localhost", 1, uuid.uuid4().hex, skip_branchtest=True, archive_mode=True
+        )
+        self.archive = HttpRequest(self.connector._build_archive_url()).cachefile
+        with ZipFile(self.archive, "w") as zipfile:
+            zipfile.writestr("project-v1/", "")
+            zipfile.writestr("project-v1/spaces/a.json", '{"name": "a"}')
+            zipfile.writestr("project-v1/spaces/b.txt", "b")
+            zipfile.writestr("project-v1/spaces/more/c.json", '{"name": "c"}')
+            zipfile.writestr("project-v1/atlases/d.json", '{"name": "d"}')
+        self.loaders = []
+
+    def tearDown(self):
+        for fname in [self.archive] + [loader.member_cachefile for loader in self.loaders]:
+            if os.path.isfile(fname):
+                os.remove(fname)
+                CACHE.index.remove(fname)
+
+    def test_archive_index(self):
+        root, paths = self.connector._archive_index
+        self.assertEqual(root, "project-v1")
+        self.assertEqual(
+            sorted(paths),
+            ["atlases/d.json", "spaces/a.json", "spaces/b.txt", "spaces/more/c.json"]
+        )
+
+    def test_search_files(self):
+        self.assertEqual(self.connector.search_files("spaces", ".json"), ["spaces/a.json"])
+        self.assertEqual(
+            sorted(self.connector.search_files("spaces", ".json", recursive=True)),
+            ["spaces/a.json", "spaces/more/c.json"]
+        )
+        self.assertEqual(len(self.connector.search_files(recursive=True)), 4)
+
+    def test_get_loader(self):
+        loader = self.connector.get_loader("c.json", "spaces/more")
+        self.loaders.append(loader)
+        self.assertIsInstance(loader, ZipfileRequest)
+        self.assertEqual(loader.data, {"name": "c"})
+        self.assertTrue(self.connector.archive_mode)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+import unittest
+import http.server
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+from siibra.retrieval import requests
+from siibra.retrieval.requests import (
+    SingleFlight, HttpRequest, LazyHttpRequest, EbrainsRequest,
+    COMPRESSION_MARKERS, read_cachefile, _compressor
+)
+from siibra.retrieval.cache import CACHE, MEMCACHE, PARTIAL_SUFFIX
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_concurrent_calls_are_coalesced(self):
+        singleflight = SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(singleflight.run("key", compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_exceptions_are_raised(self):
+        singleflight = SingleFlight()
+
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            singleflight.run("key", fail)
+        self.assertEqual(singleflight.run("key", lambda: 1), 1)
+
+
+class TestLazyHttpRequest(unittest.TestCase):
+
+    def test_loaders_share_decoded_data(self):
+        url = "https://example.org/siibra-test/shared.json"
+        loader = LazyHttpRequest(url)
+        with open(loader.cachefile, "wb") as f:
+            f.write(b'{"a": 1}')
+        try:
+            data = loader.data
+            self.assertEqual(data, {"a": 1})
+            self.assertIs(LazyHttpRequest(url).data, data)
+        finally:
+            os.remove(loader.cachefile)
+            CACHE.index.remove(loader.cachefile)
+
+    def test_oversized_data_is_kept_by_loader(self):
+        decoded = []
+
+        def decode(b):
+            decoded.append(b)
+            return b.decode()
+
+        loader = LazyHttpRequest("https://example.org/siibra-test/oversized.txt", decode)
+        with open(loader.cachefile, "wb") as f:
+            f.write(b"x" * 100)
+        try:
+            with patch.object(MEMCACHE, "maxbytes", 10):
+                data = loader.data
+                self.assertIs(loader.data, data)
+            self.assertEqual(len(decoded), 1)
+        finally:
+            os.remove(loader.cachefile)
+            CACHE.index.remove(loader.cachefile)
+
+
+class TestCacheCompression(unittest.TestCase):
+
+    def _write(self, content):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        return filename
+
+    def test_compressed_roundtrip(self):
+        payload = b'{"values": [' + b", ".join(b"%d" % i for i in range(10000)) + b"]}"
+        for codec, marker in COMPRESSION_MARKERS.items():
+            compressor = _compressor(codec)
+            # compressed in chunks, as during a download
+            chunks = [compressor.compress(payload[i:i + 1000]) for i in range(0, len(payload), 1000)]
+            content = marker + b"".join(chunks) + compressor.flush()
+            self.assertLess(len(content), len(payload))
+            self.assertEqual(read_cachefile(self._write(content)), payload, codec)
+
+    def test_uncompressed_files(self):
+        for content in [b'{"a": 1}', b"", b"x" * 100000]:
+            self.assertEqual(read_cachefile(self._write(content)), content)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            _compressor("zip")
+
+
+class TestOfflineMode(unittest.TestCase):
+
+    def test_uncached_content_is_not_requested(self):
+        loader = HttpRequest(f"http://localhost/{uuid.uuid4().hex}")
+        with patch.object(requests, "OFFLINE", True), \
+                patch.object(requests, "get_session", side_effect=AssertionError("http request")):
+            with self.assertRaisesRegex(RuntimeError, "offline mode"):
+                loader._retrieve()
+
+    def test_ebrains_token_is_not_requested(self):
+        def token(request):
+            raise AssertionError("token requested")
+
+        loader = EbrainsRequest(uuid.uuid4().hex)
+        with open(loader.cachefile, "wb") as f:
+            f.write(b'{"results": []}')
+        try:
+            with patch.object(requests, "OFFLINE", True), \
+                    patch.object(EbrainsRequest, "kg_token", property(token)):
+                self.assertEqual(loader.get(), {"results": []})
+        finally:
+            os.remove(loader.cachefile)
+            CACHE.index.remove(loader.cachefile)
+
+
+class ResumableRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    content = bytes(range(256)) * 40
+    etag = '"v1"'
+    # if set, partial responses start at the wrong offset
+    bad_range = False
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        content = self.content
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match is None or self.headers.get("If-Range") != self.etag:
+            self.send_response(200)
+            start = 0
+        else:
+            start = int(match.group(1))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if self.bad_range:
+                start = 0
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        body = content[start:]
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestResumedDownloads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), ResumableRequestHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        ResumableRequestHandler.requests = []
+        ResumableRequestHandler.bad_range = False
+        url = f"http://127.0.0.1:{self.server.server_port}/{uuid.uuid4().hex}.bin"
+        self.loader = HttpRequest(url)
+        self.partfile = f"{self.loader.cachefile}{PARTIAL_SUFFIX}"
+        self.validatorfile = f"{self.loader.cachefile}.validator{PARTIAL_SUFFIX}"
+
+    def tearDown(self):
+        for fname in [self.loader.cachefile, self.partfile, self.validatorfile]:
+            if os.path.isfile(fname):
+                os.remove(fname)
+        CACHE.index.remove(self.loader.cachefile)
+
+    def interrupt(self, partial, validator='"v1"'):
+        # leave the files of an interrupted download
+        with open(self.partfile, "wb") as f:
+            f.write(partial)
+        with open(self.validatorfile, "w") as f:
+            f.write(validator)
+
+    def assertDownloaded(self):
+        self.loader._retrieve()
+        self.assertEqual(read_cachefile(self.loader.cachefile), ResumableRequestHandler.content)
+        self.assertFalse(os.path.isfile(self.partfile))
+        self.assertFalse(os.path.isfile(self.validatorfile))
+
+    def test_resume(self):
+        self.interrupt(ResumableRequestHandler.content[:1000])
+        self.assertDownloaded()
+        self.assertEqual(len(ResumableRequestHandler.requests), 1)
+        headers = ResumableRequestHandler.requests[0]
+        self.assertEqual(headers["Range"], "bytes=1000-")
+        self.assertEqual(headers["If-Range"], '"v1"')
+
+    def test_changed_remote_file(self):
+        # the server ignores the range and sends the whole file
+        self.interrupt(b"x" * 1000, validator='"v0"')
+        self.assertDownloaded()
+        self.assertEqual(len(ResumableRequestHandler.requests), 1)
+
+    def test_restart_on_unsatisfiable_range(self):
+        self.interrupt(ResumableRequestHandler.content + b"x")
+        self.assertDownloaded()
+        self.assertEqual(len(ResumableRequestHandler.requests), 2)
+        self.assertNotIn("Range", ResumableRequestHandler.requests[1])
+
+    def test_restart_on_mismatched_content_range(self):
+        ResumableRequestHandler.bad_range = True
+        self.interrupt(ResumableRequestHandler.content[:1000])
+        self.assertDownloaded()
+        self.assertEqual(len(ResumableRequestHandler.requests), 2)
+        self.assertNotIn("Range", ResumableRequestHandler.requests[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
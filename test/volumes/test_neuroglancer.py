@@ -0,0 +1,132 @@
+import unittest
+import os
+import tempfile
+import uuid
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from cloudvolume import Bbox
+
+from siibra.volumes import NeuroglancerVolume
+from siibra.retrieval import requests
+from siibra.retrieval.cache import CACHE
+
+
+class FakeCloudVolume:
+
+    def __init__(self, data):
+        self.data = data
+        self.downloads = []
+
+    def download(self, bbox, mip):
+        (x0, y0, z0), (x1, y1, z1) = bbox.minpt, bbox.maxpt
+        self.downloads.append((tuple(bbox.minpt), tuple(bbox.maxpt)))
+        return self.data[x0:x1, y0:y1, z0:z1]
+
+
+class TestNeuroglancerChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.data = np.random.randint(0, 255, (50, 40, 30, 1)).astype("uint8")
+        url = f"http://localhost/{uuid.uuid4().hex}"
+        self.volume = NeuroglancerVolume("test_id", "test_name", url, None)
+        self.volume._cached_volume = FakeCloudVolume(self.data)
+        self.volume._info_loader = SimpleNamespace(data={
+            "data_type": "uint8",
+            "num_channels": 1,
+            "scales": [{
+                "chunk_sizes": [[16, 16, 16]],
+                "size": [50, 40, 30],
+                "voxel_offset": [0, 0, 0],
+                "resolution": [20000, 20000, 20000],
+            }],
+        })
+
+    def tearDown(self):
+        for c0, c1 in self.volume._enclosing_chunkgrid(0, Bbox((0, 0, 0), (50, 40, 30))):
+            cachefile = self.volume._chunk_cachefile(0, c0, c1)
+            if os.path.isfile(cachefile):
+                os.remove(cachefile)
+                CACHE.index.remove(cachefile)
+
+    def test_info_is_loaded_once(self):
+        resolutions = self.volume.resolutions_available
+        self.volume._info_loader = None
+        self.assertEqual(self.volume.info["data_type"], "uint8")
+        self.assertIs(self.volume.resolutions_available, resolutions)
+
+    def test_enclosing_chunkgrid(self):
+        chunks = self.volume._enclosing_chunkgrid(0, Bbox((10, 0, 20), (20, 10, 40)))
+        self.assertEqual(
+            sorted((tuple(c0), tuple(c1)) for c0, c1 in chunks),
+            [((0, 0, 16), (16, 16, 30)), ((16, 0, 16), (32, 16, 30))]
+        )
+        self.assertEqual(len(self.volume._enclosing_chunkgrid(0, Bbox((0, 0, 0), (50, 40, 30)))), 24)
+        self.assertEqual(self.volume._enclosing_chunkgrid(0, Bbox((60, 0, 0), (70, 10, 10))), [])
+
+    def test_load_chunks(self):
+        result = self.volume._load_chunks(0, Bbox((3, 5, 7), (20, 21, 22)))
+        self.assertTrue(np.array_equal(result, self.data[3:20, 5:21, 7:22]))
+        result = self.volume._load_chunks(0, Bbox((16, 16, 16), (32, 32, 30)))
+        self.assertTrue(np.array_equal(result, self.data[16:32, 16:32, 16:30]))
+        self.assertEqual(len(self.volume.volume.downloads), 1)
+
+    def test_single_chunk_is_writable(self):
+        bbox = Bbox((16, 16, 16), (32, 32, 30))
+        result = self.volume._load_chunks(0, bbox)
+        result[...] = 1
+        # the cached chunk is not modified
+        result = self.volume._load_chunks(0, bbox)
+        self.assertTrue(np.array_equal(result, self.data[16:32, 16:32, 16:30]))
+
+    def test_only_missing_chunks_are_downloaded(self):
+        self.volume._load_chunks(0, Bbox((0, 0, 0), (32, 32, 30)))
+        self.volume.volume.downloads.clear()
+        result = self.volume._load_chunks(0, Bbox((0, 0, 0), (50, 40, 30)))
+        self.assertTrue(np.array_equal(result, self.data))
+        # the missing chunks form an L-shape, which is downloaded in two boxes
+        self.assertEqual(
+            self.volume.volume.downloads,
+            [((32, 0, 0), (50, 40, 30)), ((0, 32, 0), (32, 40, 30))]
+        )
+
+    def test_offline_mode(self):
+        self.volume._load_chunks(0, Bbox((0, 0, 0), (16, 16, 16)))
+        with patch.object(requests, "OFFLINE", True):
+            # cached chunks are still available
+            result = self.volume._load_chunks(0, Bbox((0, 0, 0), (16, 16, 16)))
+            self.assertTrue(np.array_equal(result, self.data[:16, :16, :16]))
+            with self.assertRaisesRegex(RuntimeError, "offline mode"):
+                self.volume._load_chunks(0, Bbox((0, 0, 0), (32, 16, 16)))
+        self.assertEqual(len(self.volume.volume.downloads), 1)
+
+    def test_tiles_cover_region_once(self):
+        bbox = Bbox((3, 5, 7), (47, 38, 29))
+        # room for two chunks per tile
+        tile_gbytes = 2 * 16 ** 3 / 1024 ** 3
+        coverage = np.zeros((50, 40, 30), dtype=int)
+        for tile in self.volume._tiles(0, bbox, tile_gbytes):
+            (x0, y0, z0), (x1, y1, z1) = tile.minpt, tile.maxpt
+            self.assertLessEqual(tile.volume(), 2 * 16 ** 3)
+            coverage[x0:x1, y0:y1, z0:z1] += 1
+        self.assertTrue(np.all(coverage[3:47, 5:38, 7:29] == 1))
+        self.assertEqual(coverage.sum(), bbox.volume())
+
+    def test_fetch_tiles(self):
+        tiles = list(self.volume.fetch_tiles(resolution_mm=0.02, tile_gbytes=16 ** 3 / 1024 ** 3))
+        self.assertEqual(len(tiles), 24)
+        for tile, data, affine in tiles:
+            (x0, y0, z0), (x1, y1, z1) = tile.minpt, tile.maxpt
+            self.assertTrue(np.array_equal(data, self.data[x0:x1, y0:y1, z0:z1, 0]))
+            self.assertTrue(np.allclose(affine[:3, -1], np.array(tile.minpt) * 0.02))
+
+    def test_fetch_to_file(self):
+        filename = os.path.join(tempfile.mkdtemp(), "volume.nii")
+        img = self.volume.fetch_to_file(filename, resolution_mm=0.02, tile_gbytes=16 ** 3 / 1024 ** 3)
+        self.assertTrue(np.array_equal(np.asanyarray(img.dataobj), self.data[:, :, :, 0]))
+        self.assertTrue(np.allclose(img.affine, np.diag([0.02, 0.02, 0.02, 1])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import unittest
+import functools
+import http.server
+import os
+import re
+import shutil
+import tempfile
+import threading
+import uuid
+from types import SimpleNamespace
+
+import nibabel
+import numpy as np
+
+from siibra.volumes import RemoteNiftiVolume
+from siibra.retrieval.cache import CACHE
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match is None:
+            return super().do_GET()
+        start, stop = map(int, match.groups())
+        with open(self.translate_path(self.path), "rb") as f:
+            data = f.read()
+        body = data[start:stop + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestRemoteNiftiRangedReads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        data = np.arange(13 * 11 * 7 * 3, dtype="int16").reshape((13, 11, 7, 3))
+        img = nibabel.Nifti1Image(data, np.identity(4))
+        img.header.set_slope_inter(0.5, 2)
+        cls.filename = os.path.join(cls.folder, "image.nii")
+        nibabel.save(img, cls.filename)
+        cls.server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            functools.partial(RangeRequestHandler, directory=cls.folder)
+        )
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        url = f"http://127.0.0.1:{self.server.server_port}/image.nii"
+        self.volume = RemoteNiftiVolume("test_id", "test_name", url, None)
+        # small blocks, so that spans cross block boundaries
+        self.volume._range_blocksize = 100
+        self.expected = np.asanyarray(nibabel.load(self.filename).dataobj)
+
+    def tearDown(self):
+        loaders = [self.volume._header_loader] + list((self.volume._range_loaders or {}).values())
+        for loader in loaders:
+            if os.path.isfile(loader.cachefile):
+                os.remove(loader.cachefile)
+                CACHE.index.remove(loader.cachefile)
+
+    def assertReadsEqual(self, slices, mapindex=None):
+        result = self.volume._read_ranges(slices, mapindex)
+        index = slices if mapindex is None else slices + (mapindex,)
+        self.assertTrue(np.array_equal(result, self.expected[index]))
+
+    def test_whole_image(self):
+        self.assertReadsEqual((slice(None),) * 3)
+
+    def test_subvolume(self):
+        self.assertReadsEqual((slice(2, 9), slice(3, 10), slice(1, 5)))
+
+    def test_mapindex(self):
+        self.assertReadsEqual((slice(None),) * 3, mapindex=2)
+        self.assertReadsEqual((slice(2, 9), slice(0, 1), slice(4, 7)), mapindex=1)
+
+    def test_single_voxel(self):
+        self.assertReadsEqual((slice(12, 13), slice(10, 11), slice(6, 7)), mapindex=0)
+        self.assertReadsEqual((slice(0, 1), slice(5, 6), slice(3, 4)))
+
+    def test_fetch_voi(self):
+        voi = SimpleNamespace(transform_bbox=lambda affine: SimpleNamespace(
+            minpoint=np.array([1, 2, 3]), maxpoint=np.array([8, 9, 6])
+        ))
+        img = self.volume.fetch(voi=voi, mapindex=1)
+        self.assertTrue(np.array_equal(img.get_fdata(), self.expected[1:8, 2:9, 3:6, 1]))
+        self.assertTrue(np.array_equal(img.affine[:3, -1], [1, 2, 3]))
+        self.assertFalse(self.volume._image_loader.cached)
+
+    def test_header_from_cached_image(self):
+        # the image is not served, so the header can only be read from the cache
+        url = f"http://127.0.0.1:{self.server.server_port}/{uuid.uuid4().hex}.nii"
+        volume = RemoteNiftiVolume("test_id", "test_name", url, None)
+        shutil.copy(self.filename, volume._image_loader.cachefile)
+        try:
+            header = volume.header
+            self.assertEqual(header.get_data_shape(), self.expected.shape)
+            self.assertEqual(header.get_slope_inter(), (0.5, 2))
+        finally:
+            for loader in [volume._image_loader, volume._header_loader]:
+                if os.path.isfile(loader.cachefile):
+                    os.remove(loader.cachefile)
+                    CACHE.index.remove(loader.cachefile)
+
+
+if __name__ == "__main__":
+    unittest.main()